@@ -6,7 +6,7 @@ import threading
 
 # THE PURPOSE OF THIS ANALYSIS IS TO UNDERSTAND HOW DPS AFFECTS BITING RATE
 
-def SimMidges(j, dps):
+def SimMidges(j, dps, rng=None):
     midgehostratio = 100  # Midge/host ratio
 
     hostpop = 100
@@ -17,19 +17,15 @@ def SimMidges(j, dps):
     hostinf = np.full(hostpop, False)  # Entire host population is naive to BTV
 
     envir = Environment.Envir(length=1000)
-    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinf)
+    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinf, rng=rng)
     swrm = Swarm.MidgeSwarm(envir=envir, size=midgepop, hostswarm=host, infected=midges, dps=dps)
     swrm.pVtoH = 0  # Don't want to consider transmission to host
     swrm.eip = 100  # Again just to be sure
     dt = 60  # Step the simulation every 60 seconds (1 minute)
-    steps = 0  # Track the total number of steps for the simulation
 
     print("Moving swarm...")
     # RUN UNTIL ALL INFECTED MIDGES (FIRST GEN) HAVE DIED
-    while np.sum(swrm.infected) > 0 and steps <= (10 * 300):
-        swrm.move(dt)
-
-        steps += 1
+    swrm.run_until(lambda swarm: -1 if swarm.numinfected > 0 else 0, max_steps=10 * 300 + 1, dt=dt)
 
     print("Simulation finished")
 
@@ -38,9 +34,15 @@ def SimMidges(j, dps):
     print("Results saved")
 
 
+seed = None  # Entropy of the random streams (None draws fresh entropy, an integer makes the analysis reproducible)
+
+# Every thread gets its own random stream, a Generator must not be shared between threads
+dpsvalues = np.arange(0, 1, 0.05)
+streams = np.random.SeedSequence(seed).spawn(len(dpsvalues))
+
 threadlist = []
-for i in np.arange(0, 1, 0.05):
-    threadlist.append(threading.Thread(target=SimMidges, args=(1, i)))
+for i, stream in zip(dpsvalues, streams):
+    threadlist.append(threading.Thread(target=SimMidges, args=(1, i, np.random.default_rng(stream))))
     # SimMidges(1, dps=i)
     # print('DPS ' + str(i) + ' simulation completed')
 for t in threadlist:
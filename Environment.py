@@ -1,9 +1,140 @@
+import os
+import hashlib
 import numpy as np
+from PIL import Image
+from numba import njit
+
+# Boundary policies of the domain, None leaves the positions that leave the domain where they are
+BOUNDARIES = (None, 'reflect', 'periodic', 'clamp', 'respawn')
 
 
 # Environment class that may have terrain attributes in the future
 class Envir():
     # TODO: AT SOME POINT ADD SUPPORT FOR WIND IF DESIRED
-    def __init__(self, length=1000):
+    def __init__(self, length=1000, boundary=None):
         # Set the size of the environment (a square for now)
         self.length = length
+
+        # What happens to a midge or host that leaves [0, length] in either direction: 'reflect' mirrors it back off the
+        # edge, 'periodic' wraps it around to the opposite edge, 'clamp' stops it on the edge and 'respawn' replaces it
+        # at a uniformly random position of the domain
+        if boundary not in BOUNDARIES:
+            raise ValueError('Unknown boundary policy ' + repr(boundary) + ', expected one of ' + repr(BOUNDARIES))
+        self.boundary = boundary
+        # A periodic domain is a torus: the host searches measure every distance to the closest periodic image of a host
+        # (the minimum-image convention). The period is 0 for every other policy
+        self.period = float(length) if boundary == 'periodic' else 0.0
+
+    # Apply the boundary policy to an array of (..., 2) positions in place, positions inside the domain are left exactly
+    # as they are. Respawned positions are drawn from rng, no other policy allocates memory
+    def confine(self, positions, rng=None):
+        if self.boundary is None:
+            return
+        if not positions.flags.c_contiguous:
+            raise ValueError('Boundary policies are applied in place and need C-contiguous positions')
+
+        flat = positions.reshape(-1, 2)
+        if self.boundary == 'reflect':
+            reflect(flat, self.length)
+        elif self.boundary == 'periodic':
+            wrap(flat, self.length)
+        elif self.boundary == 'clamp':
+            clamp(flat, self.length)
+        else:
+            outside = outsiderows(flat, self.length)
+            flat[outside] = rng.random((outside.size, 2), dtype=flat.dtype) * flat.dtype.type(self.length)
+
+
+# Mirror every coordinate outside [0, length] back into the domain, as often as needed for coordinates far outside
+@njit(cache=True)
+def reflect(positions, length):
+    for i in range(positions.shape[0]):
+        for k in range(2):
+            p = positions[i, k]
+            if p < 0 or p > length:
+                p = abs(p) % (2 * length)
+                if p > length:
+                    p = 2 * length - p
+                positions[i, k] = p
+
+
+# Wrap every coordinate outside [0, length) around to the opposite edge
+@njit(cache=True)
+def wrap(positions, length):
+    for i in range(positions.shape[0]):
+        for k in range(2):
+            p = positions[i, k]
+            if p < 0 or p >= length:
+                p = p % length
+                # A tiny negative coordinate rounds to length itself
+                if p >= length:
+                    p = 0.0
+                positions[i, k] = p
+
+
+# Move every coordinate outside [0, length] onto the closest edge
+@njit(cache=True)
+def clamp(positions, length):
+    for i in range(positions.shape[0]):
+        for k in range(2):
+            p = positions[i, k]
+            if p < 0:
+                positions[i, k] = 0.0
+            elif p > length:
+                positions[i, k] = length
+
+
+# Returns the indices of the positions that have a coordinate outside [0, length]
+@njit(cache=True)
+def outsiderows(positions, length):
+    count = 0
+    for i in range(positions.shape[0]):
+        if not (0 <= positions[i, 0] <= length and 0 <= positions[i, 1] <= length):
+            count += 1
+
+    outside = np.empty(count, dtype=np.int64)
+    count = 0
+    for i in range(positions.shape[0]):
+        if not (0 <= positions[i, 0] <= length and 0 <= positions[i, 1] <= length):
+            outside[count] = i
+            count += 1
+    return outside
+
+
+# Returns a short hash of a file and the rankings applied to it, used to key the files in the cache directory
+def filekey(fname, rankings):
+    with open(fname, 'rb') as f:
+        return hashlib.sha256(f.read() + np.asarray(rankings, dtype=np.int64).tobytes()).hexdigest()[:16]
+
+
+# Save an array to fname through a temporary file so that other processes never see a partially written file
+def savecached(fname, arr):
+    os.makedirs(os.path.dirname(fname) or '.', exist_ok=True)
+    tmpname = fname[:-len('.npy')] + '.' + str(os.getpid()) + '.tmp.npy'
+    np.save(tmpname, arr)
+    os.replace(tmpname, fname)
+
+
+# Decode a map image to grayscale and replace each value in rankings by its index (its preference ranking)
+def decodemap(mapimage, rankings):
+    grid = np.asarray(Image.open(mapimage).convert('L'), dtype=np.uint8)
+
+    # Apply the rankings to every possible pixel value once, then remap the whole map with a single lookup
+    lookup = np.arange(256, dtype=np.uint8)
+    for i in range(len(rankings)):
+        lookup[lookup == rankings[i]] = i
+
+    return lookup[grid]
+
+
+# Returns the ranked map of an image. The ranked grid is decoded once and cached as a .npy file in cachedir, every later
+# call (from any process) opens it as a read-only memmap so all processes share one copy of the map
+def loadrankedmap(mapimage, rankings, cachedir='.midgepy_cache'):
+    if cachedir is None:
+        return decodemap(mapimage, rankings)
+
+    fname = os.path.join(cachedir, 'map-' + filekey(mapimage, rankings) + '.npy')
+    if not os.path.exists(fname):
+        savecached(fname, decodemap(mapimage, rankings))
+
+    return np.load(fname, mmap_mode='r')
@@ -2,16 +2,16 @@ import numpy as np
 import seaborn as sns
 import Swarm
 import Environment
-import multiprocessing
-import threading
+import Sweep
+import Profiler
 import time
 import csv
 
 sns.set_style('whitegrid')
 
 
-def SimMidges(i, j, dps, eip, mhr):
-    np.random.seed() # Add a random seed for the process to prevent duplication
+def SimMidges(i, j, dps, eip, mhr, rng=None):
+    rng = np.random.default_rng(rng)  # Every simulation has its own random stream (given by the sweep)
     midgehostratio = mhr  # Midge/host ratio
 
     hostpop = 100
@@ -23,8 +23,8 @@ def SimMidges(i, j, dps, eip, mhr):
     hostinf = np.full(hostpop, False)  # Entire host population is naive to BTV
 
     envir = Environment.Envir(length=1000)
-    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinf)
-    swrm = Swarm.MidgeSwarm(envir=envir, size=midgepop, hostswarm=host, infected=midges, dps=dps, eip=eip)
+    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinf, rng=rng)
+    swrm = Swarm.MidgeSwarm(envir=envir, size=midgepop, hostswarm=host, infected=midges, dps=dps, eip=eip, rng=rng)
     dt = 60  # Step the simulation every 60 seconds (1 minute)
     days = 60  # Length in days of the simulation
     daylength = 300  # Number of steps in each day
@@ -38,13 +38,9 @@ def SimMidges(i, j, dps, eip, mhr):
             print("Day", k // 300)
 
     print("Simulation finished")
+    print('Thread', i, 'Trial', j, 'finished')
 
-    with open('/blue/rcstudents/shanegladson/HeatMap/MHR' + str(midgehostratio) + 'Trial' + str(i) + '.csv', 'a') as f:
-        writer = csv.writer(f, delimiter=',')
-        print('Thread', i, 'Trial', j, 'in progress')
-        writer.writerow([dps, eip, swrm.hostswarm.totalinfectedhost[-1]])
-
-    return
+    return swrm.recorder.get('totalinfectedhost')[-1]
 
 
 params = []
@@ -54,42 +50,34 @@ for i in range(21):
 
 print(params)
 
-def CalculateHeatMap(i):
-    subprocesslist = []
-
-    for j in range(len(params)):
-        dps, eip = params[j]
-        subprocesslist.append(multiprocessing.Process(target=SimMidges, args=(i, j, dps, eip, 5)))
-
-    for t in subprocesslist:
-        t.start()
-
-    for t in subprocesslist:
-        t.join()
-
-    subprocesslist = []
+mhrs = [5, 10, 50]  # Midge/host ratios simulated for each trial
+workers = None  # Number of worker processes (None uses every CPU)
+seed = None  # Entropy of the random streams (None draws fresh entropy, an integer makes the sweep reproducible)
 
-    for j in range(len(params)):
-        dps, eip = params[j]
-        subprocesslist.append(multiprocessing.Process(target=SimMidges, args=(i, j, dps, eip, 10)))
 
-    for t in subprocesslist:
-        t.start()
-
-    for t in subprocesslist:
-        t.join()
-
-    subprocesslist = []
-
-    for j in range(len(params)):
-        dps, eip = params[j]
-        subprocesslist.append(multiprocessing.Process(target=SimMidges, args=(i, j, dps, eip, 50)))
-
-    for t in subprocesslist:
-        t.start()
-
-    for t in subprocesslist:
-        t.join()
+def CalculateHeatMap(i):
+    tasks = []
+    for mhr in mhrs:
+        for j in range(len(params)):
+            dps, eip = params[j]
+            tasks.append((i, j, dps, eip, mhr))
+
+    # Start the largest midge/host ratios first since they take the longest, cells already in the manifest of the trial
+    # are not simulated again when the script is restarted
+    perf = {}
+    results = Sweep.runsweep(SimMidges, tasks, workers=workers, order=lambda task: -task[4],
+                             manifest='/blue/rcstudents/shanegladson/HeatMap/Trial' + str(i) + '.manifest.jsonl',
+                             seedsequence=np.random.SeedSequence(seed, spawn_key=(i,)), report=perf)
+    if perf.get('phases'):
+        print(Profiler.formatreport(perf))
+
+    # Write all results of a midge/host ratio at once
+    for mhr in mhrs:
+        with Sweep.atomicopen('/blue/rcstudents/shanegladson/HeatMap/MHR' + str(mhr) + 'Trial' + str(i) + '.csv') as f:
+            writer = csv.writer(f, delimiter=',')
+            for task, result in zip(tasks, results):
+                if task[4] == mhr:
+                    writer.writerow([task[2], task[3], result])
 
 
 
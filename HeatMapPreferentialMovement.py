@@ -19,7 +19,7 @@ def StorePositions(days):
     print('Creating Host Swarm')
     host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinf)
     print('Creating Midge Swarm')
-    swrm = Swarm.MidgeSwarmPreferentialMovement(envir=envir, size=midgepop, mapimage='FarmMap.png', hostswarm=host, infected=midges, savepositions=True, dps=0.75, eip=15)
+    swrm = Swarm.MidgeSwarmPreferentialMovement(envir=envir, size=midgepop, mapimage='FarmMap.png', hostswarm=host, infected=midges, dps=0.75, eip=15)
     dt = 60  # Step the simulation every 60 seconds (1 minute)
     daylength = 300  # Number of steps in each day
     steps = daylength * days  # Total number of steps for the simulation
@@ -0,0 +1,170 @@
+import numpy as np
+from numba import njit
+
+""" Uniform grid of host positions for range-limited nearest host searches. The domain is cut into square cells whose
+side is at least the search radius, so every host within the radius of a point lies in the 3x3 block of cells around it
+and a search only looks at the host in those nine cells. The host of a cell are kept in a doubly linked list (head, next
+and previous arrays), which lets a walking host change cell in constant time: only the host that crossed a cell border
+are unlinked and linked again when the positions change, the rest of the grid is left alone.
+
+Every cell also counts the host in its 3x3 block, a point in a cell with a count of zero has no host within the radius
+and skips the search entirely. Positions outside the domain are put in the closest edge cell, which keeps every pair of
+points within one cell side of each other in neighbouring cells.
+
+On a periodic domain (period > 0) the blocks wrap around the edges and distances are taken to the closest periodic image
+of a host (the minimum-image convention). The domain is then cut into a whole number of cells, each at least as wide as
+the requested cell size, so that a host across the seam is always in a neighbouring cell.
+"""
+
+
+class HostGrid:
+
+    def __init__(self, positions, cellsize, length, period=0):
+        self.searchradius = float(cellsize)  # (m) Smallest cell side that was asked for
+        self.period = period  # (m) Length of the periodic domain, 0 if the domain does not wrap around
+        if period > 0:
+            self.cells = max(int(period // self.searchradius), 1)  # Number of cells along each side of the domain
+            self.cellsize = period / self.cells  # (m) Side of a cell, the largest radius a search can use
+        else:
+            self.cellsize = self.searchradius
+            self.cells = max(int(np.ceil(length / self.cellsize)), 1)
+        self.head = np.full(self.cells * self.cells, -1, dtype=np.int64)  # First host of every cell (-1 if empty)
+        self.next = np.full(len(positions), -1, dtype=np.int64)  # Next host in the same cell
+        self.previous = np.full(len(positions), -1, dtype=np.int64)  # Previous host in the same cell
+        self.cellof = np.full(len(positions), -1, dtype=np.int64)  # Cell of every host
+        self.nearby = np.zeros(self.cells * self.cells, dtype=np.int64)  # Number of host in the 3x3 block around a cell
+        self.update(positions)
+
+    # Move the host whose cell has changed to their new cell
+    def update(self, positions):
+        relink(positions, self.cellsize, self.cells, self.head, self.next, self.previous, self.cellof, self.nearby,
+               self.period)
+
+    # Returns the closest host within radius of every position, the vector to it and its distance. Positions with no
+    # host within radius get host -1, a zero vector and an infinite distance
+    def query(self, positions, hostpositions, radius):
+        if radius > self.cellsize:
+            raise ValueError('The search radius of a host grid cannot be larger than its cell size')
+        return gridquery(positions, hostpositions, self.head, self.next, self.nearby, self.cellsize, self.cells, radius,
+                         self.period)
+
+
+# Returns the flat index of the cell of (x, y), points outside the domain are put in the closest edge cell
+@njit(cache=True, inline='always')
+def cellindex(x, y, cellsize, cells):
+    ix = min(max(int(np.floor(x / cellsize)), 0), cells - 1)
+    iy = min(max(int(np.floor(y / cellsize)), 0), cells - 1)
+    return ix * cells + iy
+
+
+# Add count to the host counts of the 3x3 block of cells around cell, the block wraps around on a periodic domain
+@njit(cache=True)
+def addnearby(nearby, cell, cells, count, period):
+    ix, iy = cell // cells, cell % cells
+    for cx in range(ix - 1, ix + 2):
+        if period > 0:
+            cx %= cells
+        elif cx < 0 or cx >= cells:
+            continue
+        for cy in range(iy - 1, iy + 2):
+            if period > 0:
+                cy %= cells
+            elif cy < 0 or cy >= cells:
+                continue
+            nearby[cx * cells + cy] += count
+
+
+# Unlink every host that is no longer in its cell and link it at the front of the list of its new cell
+@njit(cache=True)
+def relink(positions, cellsize, cells, head, nxt, previous, cellof, nearby, period):
+    for j in range(positions.shape[0]):
+        cell = cellindex(positions[j, 0], positions[j, 1], cellsize, cells)
+        old = cellof[j]
+        if cell == old:
+            continue
+
+        if old >= 0:
+            if previous[j] >= 0:
+                nxt[previous[j]] = nxt[j]
+            else:
+                head[old] = nxt[j]
+            if nxt[j] >= 0:
+                previous[nxt[j]] = previous[j]
+            addnearby(nearby, old, cells, -1, period)
+
+        previous[j] = -1
+        nxt[j] = head[cell]
+        if head[cell] >= 0:
+            previous[head[cell]] = j
+        head[cell] = j
+        cellof[j] = cell
+        addnearby(nearby, cell, cells, 1, period)
+
+
+# Returns the index of the closest host to (x, y) in the given cell that is strictly within radius and its squared
+# distance, or -1 and infinity if there is none. The first host wins ties like np.argmin. On a periodic domain the cells
+# across the seam are searched with the host shifted by one period. Passing the arrays costs more than the search of an
+# empty neighbourhood, so callers check the nearby count of the cell before calling
+@njit(cache=True, inline='always')
+def gridnearest(x, y, cell, hostpositions, head, nxt, cells, radius, period):
+    ix, iy = cell // cells, cell % cells
+    best = -1
+    bestdistance = radius * radius
+    for cx in range(ix - 1, ix + 2):
+        shiftx = 0.0
+        if period > 0:
+            shiftx = period * ((cx + cells) // cells - 1)
+            cx %= cells
+        elif cx < 0 or cx >= cells:
+            continue
+        for cy in range(iy - 1, iy + 2):
+            shifty = 0.0
+            if period > 0:
+                shifty = period * ((cy + cells) // cells - 1)
+                cy %= cells
+            elif cy < 0 or cy >= cells:
+                continue
+            j = head[cx * cells + cy]
+            while j >= 0:
+                dx = hostpositions[j, 0] + shiftx - x
+                dy = hostpositions[j, 1] + shifty - y
+                distance = dx * dx + dy * dy
+                if distance < bestdistance or (distance == bestdistance and 0 <= j < best):
+                    bestdistance = distance
+                    best = j
+                j = nxt[j]
+
+    if best < 0:
+        return -1, np.inf
+    return best, bestdistance
+
+
+# Range-limited closest host search for a batch of positions, see HostGrid.query
+@njit(cache=True)
+def gridquery(positions, hostpositions, head, nxt, nearby, cellsize, cells, radius, period):
+    closesthost = np.empty(positions.shape[0], dtype=np.int64)
+    directions = np.zeros(positions.shape)
+    distances = np.empty(positions.shape[0])
+
+    for i in range(positions.shape[0]):
+        closesthost[i] = -1
+        distances[i] = np.inf
+        cell = cellindex(positions[i, 0], positions[i, 1], cellsize, cells)
+        if nearby[cell] == 0:
+            continue
+
+        best, distance = gridnearest(positions[i, 0], positions[i, 1], cell, hostpositions, head, nxt, cells, radius,
+                                     period)
+        closesthost[i] = best
+        distances[i] = np.sqrt(distance)
+        if best >= 0:
+            # Vector to the closest periodic image of the host
+            dx = hostpositions[best, 0] - positions[i, 0]
+            dy = hostpositions[best, 1] - positions[i, 1]
+            if period > 0:
+                dx -= period * np.round(dx / period)
+                dy -= period * np.round(dy / period)
+            directions[i, 0] = dx
+            directions[i, 1] = dy
+
+    return closesthost, directions, distances
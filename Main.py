@@ -3,8 +3,8 @@ import seaborn as sns
 import Swarm
 import Environment
 from SALib.sample import saltelli
-import multiprocessing
-from multiprocessing.pool import Pool
+import Sweep
+import Profiler
 import numpy as np
 import time
 import os
@@ -12,8 +12,8 @@ import os
 sns.set_style('whitegrid')
 
 
-def SimMidges(iim, dps, eip, pVtoH, pHtoV, incubationtime):
-    np.random.seed()  # Add a random seed to prevent result duplication
+def SimMidges(iim, dps, eip, pVtoH, pHtoV, incubationtime, rng=None):
+    rng = np.random.default_rng(rng)  # Every simulation has its own random stream (given by the sweep)
     midgehostratio = 100  # Midge/host ratio
 
     hostpop = 100
@@ -25,9 +25,9 @@ def SimMidges(iim, dps, eip, pVtoH, pHtoV, incubationtime):
     hostinf = np.full(hostpop, False)  # Entire host population is naive to BTV
 
     envir = Environment.Envir(length=1000)
-    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinf, incubationtime=incubationtime)
+    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinf, incubationtime=incubationtime, rng=rng)
     swrm = Swarm.MidgeSwarm(envir=envir, size=midgepop, hostswarm=host, infected=midges, dps=dps, eip=eip,
-                            pVtoH=pVtoH, pHtoV=pHtoV)
+                            pVtoH=pVtoH, pHtoV=pHtoV, rng=rng)
     dt = 60  # Step the simulation every 60 seconds (1 minute)
     steps = 300 * 60  # Total number of steps for the simulation
 
@@ -44,7 +44,7 @@ def SimMidges(iim, dps, eip, pVtoH, pHtoV, incubationtime):
     # swrm.writetocsv(trial=j)
     # print("Results saved")
 
-    return swrm.hostswarm.totalinfectedhost[-1]
+    return swrm.recorder.get('totalinfectedhost')[-1]
 
 
 problem = {
@@ -61,6 +61,8 @@ problem = {
 
 params = saltelli.sample(problem, 16)
 print(params.shape)
+workers = None  # Number of worker processes (None uses every CPU)
+seed = None  # Entropy of the random streams (None draws fresh entropy, an integer makes the sweep reproducible)
 
 
 def SaveAnalysis(iim, i):
@@ -69,12 +71,17 @@ def SaveAnalysis(iim, i):
     for j, X in enumerate(params):
         dps, eip, pVtoH, pHtoV, incubationtime = X
         inputs.append((iim, dps, eip, pVtoH, pHtoV, incubationtime))
-    with Pool() as pool:
-        print('CPU count:', os.cpu_count())
-        for result in pool.starmap(SimMidges, inputs):
-            results.append(result)
-
-    np.savetxt(fname='/blue/rcstudents/shanegladson/IIM' + str(iim) + '/Trial' + str(i) + '.csv', X=results, delimiter=',', newline='\n')
+    print('CPU count:', os.cpu_count())
+    fname = '/blue/rcstudents/shanegladson/IIM' + str(iim) + '/Trial' + str(i)
+    perf = {}
+    for result in Sweep.runsweep(SimMidges, inputs, workers=workers, manifest=fname + '.manifest.jsonl',
+                                 seedsequence=np.random.SeedSequence(seed, spawn_key=(iim, i)), report=perf):
+        results.append(result)
+    if perf.get('phases'):
+        print(Profiler.formatreport(perf))
+
+    with Sweep.atomicopen(fname + '.csv') as f:
+        np.savetxt(f, X=results, delimiter=',', newline='\n')
 
 
 threadlist = []
@@ -0,0 +1,136 @@
+import os
+import numpy as np
+from Environment import filekey, loadrankedmap, savecached
+
+""" Movement policies decide where the roaming midges (and walking host) head. MidgeSwarm asks its policy for a new unit
+vector for every midge once every refresh steps and moves the midges that are not seeking a host along it, so a policy
+only has to provide:
+
+    refresh                    Number of steps between two new sets of vectors
+    propose(positions, rng)    Returns a unit vector for every position (an (n x 2) array of the same dtype), all random
+                               draws are taken from rng
+
+UniformMovement heads to a uniformly random point of the domain and LandscapeMovement to the most preferred neighbouring
+tile of a map. A new policy (wind, odour plumes...) only needs the same two members to run on the shared simulation core.
+"""
+
+
+# Heads to a uniformly random point of the domain
+class UniformMovement:
+
+    def __init__(self, envir, refresh=30):
+        self.length = envir.length
+        self.refresh = refresh  # Steps between two new sets of vectors
+
+    # Returns a unit vector from every position to a random point of the domain
+    def propose(self, positions, rng):
+        return generate_random_vector(self.length, positions.shape[0], positions, rng)
+
+
+# Heads to one of the neighbouring tiles of a map with the highest preference ranking
+class LandscapeMovement:
+
+    def __init__(self, envir, mapimage, rankings=(192, 225, 137, 57, 200), scale=5, refresh=30,
+                 cachedir='.midgepy_cache'):
+        self.length = envir.length
+        self.refresh = refresh  # Steps between two new sets of vectors
+        self.scale = scale  # (m) Side of a map tile
+        self.rankings = list(rankings)  # Map value ranking system for midges (water=200, woods=57, savannah=137, pasture=225, pine=192)
+        # Import the map file (200x200), where one pixel is 5 meters, reformatted to have rankings 0-4. The ranked map is
+        # cached in cachedir and shared read-only between processes
+        self.map = loadrankedmap(mapimage, self.rankings, cachedir)
+        # Candidate tiles for preferential movement around every tile of the map, cached in cachedir (None disables)
+        self.preferences = loadpreferencetable(mapimage, self.map, self.rankings, cachedir)
+
+    # Returns a unit vector from every position to the centre of a preferred neighbouring tile
+    def propose(self, positions, rng):
+        vectors = preferentialvector(self.length, positions.shape[0], positions, self.scale, self.preferences, rng)
+        return vectors.astype(positions.dtype, copy=False)
+
+
+# Returns a unit vector from each position to a random position within the domain
+def generate_random_vector(length, size, positions, rng):
+    # Creates a vector from the midge to a random position within the domain, then the midge will follow that vector
+    newvectors = rng.random((size, 2), dtype=positions.dtype) * positions.dtype.type(length) - positions
+    newvectors /= np.expand_dims(np.linalg.norm(newvectors, axis=1), axis=1)
+
+    return newvectors
+
+
+# Offsets of the 3x3 neighbourhood around a map tile (includes current tile)
+NEIGHBOROFFSETS = np.array([(i, j) for i in range(-1, 2) for j in range(-1, 2)])
+
+
+# Returns vector for preferential random movement on the map (includes current tile), preferences is the table built by
+# buildpreferencetable for the map and rng is the random number generator of the swarm
+def preferentialvector(length, size, positions, scale, preferences, rng):
+    counts, candidates = preferences
+
+    # One draw per midge for the tile choice and two for the random position used if it has no neighbouring tile
+    draws = rng.random((size, 3))
+
+    # Vector to a random position within the domain, used by midges that have no neighbouring tile on the map
+    altvectors = draws[:, 1:] * length
+
+    # Find corresponding index on map array by truncating to int and converting by scale, the table starts at tile -1
+    tiles = np.trunc(positions / scale).astype(np.int64)
+    rows = np.clip(tiles[:, 0] + 1, 0, counts.shape[0] - 1)
+    cols = np.clip(tiles[:, 1] + 1, 0, counts.shape[1] - 1)
+    onmap = (rows == tiles[:, 0] + 1) & (cols == tiles[:, 1] + 1)
+    count = np.where(onmap, counts[rows, cols], 0)
+
+    # Randomly select one of the neighbouring tiles with the maximum value
+    choice = np.floor(draws[:, 0] * count).astype(np.int64)
+    chosen = candidates[rows, cols, np.minimum(choice, 8)]
+
+    # Convert the chosen tile back to the x,y coordinates of its centre on the grid
+    newvectors = (tiles + NEIGHBOROFFSETS[chosen] + 0.5) * scale
+
+    # If there are no possible choices (the midge is off the map), just wander in random walk
+    offmap = count == 0
+    newvectors[offmap] = altvectors[offmap]
+
+    # Now that the new positions have been found, we must convert them to vectors by subtracting the original positions
+    newvectors -= positions
+    # Scale the vector to be of length one, a walker that is already on the centre of the chosen tile stays there
+    norms = np.expand_dims(np.linalg.norm(newvectors, axis=1), axis=1)
+    np.divide(newvectors, norms, out=newvectors, where=norms != 0)
+
+    return newvectors
+
+
+# Builds the preferential movement table of a ranked map. For every tile from -1 to the map size in each direction it
+# holds the number of neighbouring tiles with the maximum value (uint8) and the indices into NEIGHBOROFFSETS of those
+# tiles, packed at the front of 9 uint8 slots. Neighbours off the map (including negative indices) are never candidates
+def buildpreferencetable(map_arr):
+    rows, cols = map_arr.shape
+
+    # Pad the map with -1 twice so that the neighbours of the tiles just off the map are padding as well
+    paddedmap = np.pad(map_arr.astype(np.int16), 2, constant_values=-1)
+    values = np.stack([paddedmap[1 + i:rows + 3 + i, 1 + j:cols + 3 + j] for i, j in NEIGHBOROFFSETS], axis=-1)
+
+    maxvalues = values.max(axis=-1, keepdims=True)
+    ismax = (values == maxvalues) & (maxvalues >= 0)
+
+    counts = ismax.sum(axis=-1).astype(np.uint8)
+    candidates = np.argsort(~ismax, axis=-1, kind='stable').astype(np.uint8)
+
+    return counts, candidates
+
+
+# Returns the preference table of a ranked map, building it only if it is not already in cachedir for the same map file
+# and rankings. Like the ranked map, the cached table is opened as a read-only memmap shared between processes
+def loadpreferencetable(mapimage, map_arr, rankings, cachedir):
+    if cachedir is None:
+        return buildpreferencetable(map_arr)
+
+    key = filekey(mapimage, rankings)
+    countsname = os.path.join(cachedir, 'preferencecounts-' + key + '.npy')
+    candidatesname = os.path.join(cachedir, 'preferencecandidates-' + key + '.npy')
+
+    if not (os.path.exists(countsname) and os.path.exists(candidatesname)):
+        counts, candidates = buildpreferencetable(map_arr)
+        savecached(candidatesname, candidates)
+        savecached(countsname, counts)
+
+    return np.load(countsname, mmap_mode='r'), np.load(candidatesname, mmap_mode='r')
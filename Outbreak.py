@@ -1,12 +1,12 @@
 import numpy as np
 import Swarm
 import Environment
-import threading
-import multiprocessing
+import Sweep
 import time
 
 
-def Outbreak(dps, eip, iim, pVtoH):
+def Outbreak(dps, eip, iim, pVtoH, rng=None):
+    rng = np.random.default_rng(rng)
     midgehostratio = 1  # Midge/host ratio
 
     hostpop = 100
@@ -18,20 +18,39 @@ def Outbreak(dps, eip, iim, pVtoH):
     hostinfected = np.full(hostpop, False)  # Entire deer population is naive to BTV
 
     envir = Environment.Envir(length=1000)
-    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinfected)
-    swrm = Swarm.MidgeSwarm(envir=envir, size=midgepop, hostswarm=host, infected=midges, dps=dps, eip=eip, pVtoH=pVtoH)
+    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinfected, rng=rng)
+    swrm = Swarm.MidgeSwarm(envir=envir, size=midgepop, hostswarm=host, infected=midges, dps=dps, eip=eip, pVtoH=pVtoH, rng=rng)
     dt = 60  # Step the simulation every 60 seconds (1 minute)
 
-    while True:
-        if np.sum(swrm.get_infected()) == 0 and (np.sum(swrm.hostswarm.incubationstarttime) == 0):
-            return 0
-        elif np.sum(swrm.hostswarm.incubationstarttime) != 0:
-            return 1
+    outcome, step = swrm.run_until(Swarm.outbreakoutcome, maxsteps, dt)
 
-        swrm.move(dt)
+    return int(outcome == 1)
+
+
+# Same as Outbreak, but simulates numsims replicates at once and returns the outcome (0 or 1) of every replicate
+def OutbreakEnsemble(dps, eip, iim, pVtoH, numsims, rng=None):
+    midgehostratio = 1  # Midge/host ratio
+
+    hostpop = 100
+    midgepop = hostpop * midgehostratio
+
+    midges = np.full(midgepop, False)
+    midges[0:iim] = True  # Let some midges be infected with BTV
+
+    hostinfected = np.full(hostpop, False)  # Entire deer population is naive to BTV
+
+    envir = Environment.Envir(length=1000)
+    ensemble = Swarm.MidgeEnsemble(envir=envir, replicates=numsims, size=midgepop, hostsize=hostpop, infected=midges,
+                                   hostinfected=hostinfected, dps=dps, eip=eip, pVtoH=pVtoH, rng=rng)
+    dt = 60  # Step the simulation every 60 seconds (1 minute)
+
+    outcome, finishstep = ensemble.run_until(Swarm.outbreakoutcome, maxsteps, dt)
+
+    return (outcome == 1).astype(float)
 
 
 numsims = 500
+maxsteps = 300 * 100  # Simulations still undecided after 100 days are stopped and do not count as an outbreak
 iim = [1, 2, 3, 4, 5, 15, 50, 100]
 
 # Daily survival probability
@@ -40,34 +59,32 @@ dps = np.linspace(0.0, 1.0, num=51, endpoint=True)
 ptrans = [0.25, 0.5, 0.75, 1.0]
 print(dps)
 eip = 14  # NOT IMPORTANT FOR THIS MODEL
-numoutbreaks = np.empty(shape=(dps.shape[0], 2), dtype=float)
-
-
-# Individual thread run on each IIM
-def ThreadSet(iim):
-    for pVtoH in ptrans:
-        for i in range(dps.shape[0]):
-            success = np.empty(shape=numsims, dtype=float)
-            for j in range(numsims):
-                success[j] = Outbreak(dps=dps[i], eip=eip, iim=iim, pVtoH=pVtoH)
-                if j % (numsims + 1) / 5 == 0:
-                    print('IIM:', iim, 'DPS:', dps[i], 'pVtoH:', pVtoH,  'Simulation:', j)
+workers = None  # Number of worker processes (None uses every CPU)
+seed = None  # Entropy of the random streams (None draws fresh entropy, an integer makes the sweep reproducible)
+manifest = '/blue/rcstudents/shanegladson/Outbreak.manifest.jsonl'  # Finished cells, skipped on a restart
 
-            numoutbreaks[i, 0] = dps[i]
-            numoutbreaks[i, 1] = np.sum(success)
 
-        print(numoutbreaks)
-        np.savetxt('/blue/rcstudents/shanegladson/IIM' + str(iim) + '/OutbreakProbabilityLongerpVtoH' + str(pVtoH) +
-                   '.csv', X=numoutbreaks, delimiter=',', newline='\n')
+# Number of outbreaks out of numsims simulations for one cell of the parameter grid
+def OutbreakCell(iim, pVtoH, dps, rng=None):
+    success = OutbreakEnsemble(dps=dps, eip=eip, iim=iim, pVtoH=pVtoH, numsims=numsims, rng=rng)
+    print('IIM:', iim, 'DPS:', dps, 'pVtoH:', pVtoH,  'Outbreaks:', np.sum(success))
 
+    return np.sum(success)
 
-threadlist = []
 
 if __name__ == '__main__':
-    for i in iim:
-        p = multiprocessing.Process(target=ThreadSet, args=(i,))
-        threadlist.append(p)
-        p.start()
+    tasks = [(i, pVtoH, d) for i in iim for pVtoH in ptrans for d in dps]
+    results = Sweep.runsweep(OutbreakCell, tasks, workers=workers, manifest=manifest,
+                             seedsequence=np.random.SeedSequence(seed))
 
-    for p in threadlist:
-        p.join()
+    # Write the outbreak counts of every (IIM, pVtoH) pair once all of its cells are finished
+    for i in iim:
+        for pVtoH in ptrans:
+            numoutbreaks = np.empty(shape=(dps.shape[0], 2), dtype=float)
+            numoutbreaks[:, 0] = dps
+            numoutbreaks[:, 1] = [result for task, result in zip(tasks, results) if task[:2] == (i, pVtoH)]
+
+            print(numoutbreaks)
+            with Sweep.atomicopen('/blue/rcstudents/shanegladson/IIM' + str(i) + '/OutbreakProbabilityLongerpVtoH' + str(pVtoH) +
+                                  '.csv') as f:
+                np.savetxt(f, X=numoutbreaks, delimiter=',', newline='\n')
@@ -6,7 +6,7 @@ import multiprocessing
 import time
 
 
-def Outbreak(dps, eip, iim, pVtoH):
+def Outbreak(dps, eip, iim, pVtoH, rng=None):
     midgehostratio = 1  # Midge/host ratio
 
     hostpop = 100
@@ -18,20 +18,17 @@ def Outbreak(dps, eip, iim, pVtoH):
     hostinfected = np.full(hostpop, False)  # Entire deer population is naive to BTV
 
     envir = Environment.Envir(length=1000)
-    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinfected)
+    host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinfected, rng=rng)
     swrm = Swarm.MidgeSwarmPreferentialMovement(envir=envir, size=midgepop, hostswarm=host, mapimage='FarmMap.png', infected=midges, dps=dps, eip=eip, pVtoH=pVtoH)
     dt = 60  # Step the simulation every 60 seconds (1 minute)
 
-    while True:
-        if np.sum(swrm.get_infected()) == 0 and (np.sum(swrm.hostswarm.incubationstarttime) == 0):
-            return 0
-        elif np.sum(swrm.hostswarm.incubationstarttime) != 0:
-            return 1
+    outcome, step = swrm.run_until(Swarm.outbreakoutcome, maxsteps, dt)
 
-        swrm.move(dt)
+    return int(outcome == 1)
 
 
 numsims = 500
+maxsteps = 300 * 100  # Simulations still undecided after 100 days are stopped and do not count as an outbreak
 iim = [1, 2, 3, 4, 5, 15, 50, 100]
 
 # Daily survival probability
@@ -41,15 +38,17 @@ ptrans = [0.25, 0.5, 0.75, 1.0]
 print(dps)
 eip = 14  # NOT IMPORTANT FOR THIS MODEL
 numoutbreaks = np.empty(shape=(dps.shape[0], 2), dtype=float)
+seed = None  # Entropy of the random streams (None draws fresh entropy, an integer makes the sweep reproducible)
 
 
 # Individual thread run on each IIM
-def ThreadSet(iim):
+def ThreadSet(iim, seedsequence):
+    rng = np.random.default_rng(seedsequence)  # Random stream of this process, shared by its simulations
     for pVtoH in ptrans:
         for i in range(dps.shape[0]):
             success = np.empty(shape=numsims, dtype=float)
             for j in range(numsims):
-                success[j] = Outbreak(dps=dps[i], eip=eip, iim=iim, pVtoH=pVtoH)
+                success[j] = Outbreak(dps=dps[i], eip=eip, iim=iim, pVtoH=pVtoH, rng=rng)
                 if j % (numsims + 1) / 5 == 0:
                     print('IIM:', iim, 'DPS:', dps[i], 'pVtoH:', pVtoH,  'Simulation:', j)
 
@@ -64,8 +63,9 @@ def ThreadSet(iim):
 threadlist = []
 
 if __name__ == '__main__':
-    for i in iim:
-        p = multiprocessing.Process(target=ThreadSet, args=(i,))
+    # Spawn an independent random stream for every process instead of sharing the state of the parent
+    for i, seedsequence in zip(iim, np.random.SeedSequence(seed).spawn(len(iim))):
+        p = multiprocessing.Process(target=ThreadSet, args=(i, seedsequence))
         threadlist.append(p)
         p.start()
 
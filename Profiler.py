@@ -0,0 +1,126 @@
+import os
+import time
+import contextlib
+
+""" Optional instrumentation of the phases of a simulation step. A profiler keeps the number of calls and the cumulative
+time of every phase and the sizes of the large temporary arrays. It is off by default, a disabled profiler hands out a
+shared no-op context so the instrumented code pays next to nothing for it. Set the environment variable MIDGEPY_PROFILE=1
+(or pass profile=True to the swarm) to switch it on.
+
+The enabled profilers created inside a collecting() block are also kept in the list it returns, so the reports of all
+swarms of a sweep task can be collected in the worker and merged in the parent (see Sweep.runsweep). A profiler created
+outside of any block is only held by its swarm and goes away with it.
+"""
+
+collectors = []  # Lists of the open collecting() blocks, every enabled profiler created is added to each of them
+NULLPHASE = contextlib.nullcontext()
+
+
+# Returns whether profiling is switched on through the environment
+def profilingenabled():
+    return os.environ.get('MIDGEPY_PROFILE', '') not in ('', '0')
+
+
+class Profiler:
+
+    def __init__(self, enabled=None):
+        self.enabled = profilingenabled() if enabled is None else enabled
+        self.timings = {}  # Phase name -> [calls, seconds]
+        self.allocations = {}  # Temporary name -> [count, total bytes, largest bytes]
+
+        if self.enabled:
+            for collected in collectors:
+                collected.append(self)
+
+    # Returns a context that times the code inside it as the given phase
+    def phase(self, name):
+        if not self.enabled:
+            return NULLPHASE
+        return Phase(self.timings, name)
+
+    # Record the size of a temporary array
+    def allocation(self, name, array):
+        if not self.enabled:
+            return
+        entry = self.allocations.setdefault(name, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += array.nbytes
+        entry[2] = max(entry[2], array.nbytes)
+
+    # Returns the timings and allocation sizes collected so far
+    def report(self):
+        return {'phases': {name: {'calls': calls, 'seconds': seconds}
+                           for name, (calls, seconds) in self.timings.items()},
+                'allocations': {name: {'count': count, 'bytes': total, 'maxbytes': largest}
+                                for name, (count, total, largest) in self.allocations.items()}}
+
+
+# Times a single phase, adds the call and the elapsed time to timings when the block is left
+class Phase:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        entry = self.timings.setdefault(self.name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+# Merge a list of reports into one, calls, times and bytes are added up and the largest allocation is kept
+def mergereports(reports):
+    merged = {'phases': {}, 'allocations': {}}
+    for report in reports:
+        for name, phase in report['phases'].items():
+            entry = merged['phases'].setdefault(name, {'calls': 0, 'seconds': 0.0})
+            entry['calls'] += phase['calls']
+            entry['seconds'] += phase['seconds']
+        for name, allocation in report['allocations'].items():
+            entry = merged['allocations'].setdefault(name, {'count': 0, 'bytes': 0, 'maxbytes': 0})
+            entry['count'] += allocation['count']
+            entry['bytes'] += allocation['bytes']
+            entry['maxbytes'] = max(entry['maxbytes'], allocation['maxbytes'])
+
+    return merged
+
+
+# Gathers the enabled profilers created inside the block in the list it returns, the caller owns the list (and with it the
+# profilers) and passes it to collect() for the merged report
+@contextlib.contextmanager
+def collecting():
+    collected = []
+    collectors.append(collected)
+    try:
+        yield collected
+    finally:
+        collectors[:] = [other for other in collectors if other is not collected]
+
+
+# Returns the merged report of a list of profilers
+def collect(profilers):
+    return mergereports([profiler.report() for profiler in profilers])
+
+
+# Returns a report as a table with the phases sorted by their share of the total time
+def formatreport(report):
+    total = sum(phase['seconds'] for phase in report['phases'].values())
+    lines = ['{:<16}{:>12}{:>12}{:>8}'.format('Phase', 'Calls', 'Seconds', '%')]
+    for name, phase in sorted(report['phases'].items(), key=lambda item: -item[1]['seconds']):
+        lines.append('{:<16}{:>12}{:>12.3f}{:>8.1f}'.format(name, phase['calls'], phase['seconds'],
+                                                             100 * phase['seconds'] / total if total else 0.0))
+
+    if report['allocations']:
+        lines.append('')
+        lines.append('{:<16}{:>12}{:>12}{:>12}'.format('Temporary', 'Count', 'Mean KiB', 'Max KiB'))
+        for name, allocation in sorted(report['allocations'].items()):
+            lines.append('{:<16}{:>12}{:>12.1f}{:>12.1f}'.format(name, allocation['count'],
+                                                                 allocation['bytes'] / allocation['count'] / 1024,
+                                                                 allocation['maxbytes'] / 1024))
+
+    return '\n'.join(lines)
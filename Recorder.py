@@ -0,0 +1,161 @@
+import os
+import json
+import numpy as np
+
+""" The recorder stores the time series produced by a simulation (infected counts, bites, midge positions, ...) in
+preallocated typed buffers instead of Python lists. Every channel holds one row per recorded step. Once a channel has
+filled chunksize rows the chunk is either appended to a binary file in the recorder directory, which keeps the memory
+use bounded for any length of run, or kept in memory if no directory was given. The rows of a directory recorder that
+have not filled a chunk yet only reach the disk when it is closed.
+"""
+
+
+class Recorder:
+
+    def __init__(self, path=None, stride=1, chunksize=1000):
+        self.path = path  # Directory the channels are flushed to (None keeps every chunk in memory)
+        self.stride = stride  # Only every stride-th step is recorded
+        self.chunksize = chunksize  # Number of rows buffered per channel before they are flushed
+        self.channels = {}
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    # Add a channel where every recorded row has the given shape and dtype
+    def addchannel(self, name, shape=(), dtype=np.int64):
+        self.channels[name] = Channel(name, shape, dtype, self.chunksize, self.path, self.stride)
+
+    # Returns whether the given step falls on the record stride
+    def records(self, step):
+        return step % self.stride == 0
+
+    # Record a value for the channel, steps that do not fall on the record stride are skipped
+    def record(self, step, name, value):
+        if step % self.stride == 0:
+            self.channels[name].append(value)
+
+    # Returns every recorded row of a channel as a single array (read-only memmap if the channel is on disk)
+    def get(self, name):
+        return self.channels[name].get()
+
+    # Returns the steps at which the rows of a channel were recorded
+    def steps(self, name):
+        return np.arange(len(self.channels[name])) * self.stride
+
+    # Replace every recorded row of a channel with rows (used when a swarm is restored from a snapshot)
+    def load(self, name, rows):
+        self.channels[name].load(rows)
+
+    # Returns a new recorder with the same stride and chunk size and a copy of every channel, kept in path (None keeps
+    # it in memory)
+    def copy(self, path=None):
+        recorder = Recorder(path=path, stride=self.stride, chunksize=self.chunksize)
+        for name, channel in self.channels.items():
+            recorder.addchannel(name, shape=channel.shape, dtype=channel.dtype)
+            recorder.load(name, self.get(name))
+        return recorder
+
+    # Write any buffered rows of every channel to disk
+    def flush(self):
+        for channel in self.channels.values():
+            channel.flush()
+
+    # Write the last partial chunk of every channel and its metadata, call it (or use the recorder in a with block) at
+    # the end of a run or the rows since the last full chunk are lost. The files are only open while a chunk is written,
+    # so the recorder can still record after it is closed
+    def close(self):
+        for channel in self.channels.values():
+            channel.flush()
+            if channel.fname is not None:
+                channel.writemetadata()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# A single recorded time series, rows are buffered in a fixed size array and moved out in chunks
+class Channel:
+
+    def __init__(self, name, shape, dtype, chunksize, path, stride):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.stride = stride
+        self.buffer = np.empty((chunksize, *self.shape), dtype=self.dtype)
+        self.filled = 0  # Number of rows in the buffer
+        self.count = 0  # Number of rows that have been moved out of the buffer
+        self.chunks = []  # Flushed chunks when the channel is kept in memory
+
+        if path is None:
+            self.fname = None
+        else:
+            # Start a new binary file, the metadata sidecar describes how to read it back
+            self.fname = os.path.join(path, name + '.bin')
+            open(self.fname, 'wb').close()
+            self.writemetadata()
+
+    def __len__(self):
+        return self.count + self.filled
+
+    # Add one row to the buffer, flushing it first if it is full
+    def append(self, value):
+        if self.filled == self.buffer.shape[0]:
+            self.flush()
+        self.buffer[self.filled] = value
+        self.filled += 1
+
+    # Move the buffered rows to disk (or to the list of chunks in memory)
+    def flush(self):
+        if self.filled == 0:
+            return
+
+        if self.fname is None:
+            # Hand the filled buffer over and start a new one instead of copying it
+            self.chunks.append(self.buffer[:self.filled])
+            self.buffer = np.empty_like(self.buffer)
+        else:
+            with open(self.fname, 'ab') as f:
+                self.buffer[:self.filled].tofile(f)
+
+        self.count += self.filled
+        self.filled = 0
+
+        if self.fname is not None:
+            self.writemetadata()
+
+    # Throw away every row and record rows instead
+    def load(self, rows):
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, *self.shape)
+        self.filled = 0
+        self.count = 0
+        self.chunks = []
+
+        if self.fname is not None:
+            open(self.fname, 'wb').close()
+
+        if rows.shape[0] != 0:
+            if self.fname is None:
+                self.chunks.append(rows.copy())
+            else:
+                with open(self.fname, 'ab') as f:
+                    rows.tofile(f)
+            self.count = rows.shape[0]
+
+        if self.fname is not None:
+            self.writemetadata()
+
+    def writemetadata(self):
+        with open(self.fname[:-len('.bin')] + '.json', 'w') as f:
+            json.dump({'dtype': self.dtype.str, 'shape': self.shape, 'count': self.count, 'stride': self.stride}, f)
+
+    def get(self):
+        if self.fname is None:
+            return np.concatenate([*self.chunks, self.buffer[:self.filled]])
+
+        self.flush()
+        if self.count == 0:
+            return np.empty((0, *self.shape), dtype=self.dtype)
+        return np.memmap(self.fname, dtype=self.dtype, mode='r', shape=(self.count, *self.shape))
@@ -0,0 +1,75 @@
+import os
+import json
+import numpy as np
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+""" Writers for the per-step results of a simulation. The table is built from the recorded time series as NumPy columns
+and written in one call, the run parameters (which are the same on every row) are stored once as metadata: in a .json
+sidecar for CSV, as a 'parameters' entry for NPZ and in the schema metadata for Parquet.
+"""
+
+
+# Returns the run parameters of a swarm, keyed by the column names used in the original result files
+def resultparameters(swarm):
+    totalinfectedmidges = swarm.recorder.get('totalinfectedmidges')
+    parameters = {'VF': swarm.activeflightvelocity, 'VR': swarm.roamflightvelocity, 'DD': swarm.detectiondistance,
+                  'EIP': swarm.eip, 'PVTH': swarm.pVtoH, 'PHTV': swarm.pHtoV, 'DPS': swarm.dps,
+                  'PD': swarm.hostswarm.size, 'BR': swarm.biterate, 'MDR': swarm.size // swarm.hostswarm.size,
+                  'IIM': int(totalinfectedmidges[0]) if len(totalinfectedmidges) else 0}
+
+    # With a temperature schedule the EIP, DPS and BR change every day, the schedule they follow is stored instead
+    if swarm.schedule is not None:
+        del parameters['EIP'], parameters['DPS'], parameters['BR']
+        parameters.update(swarm.schedule.parameters())
+
+    return parameters
+
+
+# Returns the per-step results table of a swarm as a dictionary of columns
+def resultstable(swarm):
+    recorder = swarm.recorder
+    steps = recorder.steps('totalinfectedhost')
+    totalinfectedmidges = np.asarray(recorder.get('totalinfectedmidges'))
+    totalinfectedhost = np.asarray(recorder.get('totalinfectedhost'))
+
+    table = {'Step': steps,
+             'Day': steps / float(swarm.daylength),
+             'Infected Midges': totalinfectedmidges,
+             'Infected Midges %': totalinfectedmidges / swarm.size * 100,
+             'Infected Host': totalinfectedhost,
+             'Infected Host %': totalinfectedhost / swarm.hostswarm.size * 100,
+             'Midge Bites': np.asarray(recorder.get('midgebitesperstep')),
+             'Infected Midge Bites': np.asarray(recorder.get('infectedbitesperstep'))}
+
+    if swarm.midgedeath:
+        table['Infected Deaths'] = np.asarray(swarm.infecteddeaths)[steps // swarm.daylength]
+        table['Uninfected Deaths'] = np.asarray(swarm.uninfecteddeaths)[steps // swarm.daylength]
+
+    return table
+
+
+# Write the results of a swarm to fname, format is one of 'csv', 'npz' or 'parquet' (requires pyarrow)
+def writeresults(swarm, fname, format='csv'):
+    table = resultstable(swarm)
+    parameters = resultparameters(swarm)
+
+    if format == 'csv':
+        columns = np.column_stack(list(table.values()))
+        fmt = ['%.10g' if np.issubdtype(column.dtype, np.floating) else '%d' for column in table.values()]
+        np.savetxt(fname, columns, fmt=fmt, delimiter=',', header=','.join(table), comments='')
+        with open(os.path.splitext(fname)[0] + '.json', 'w') as f:
+            json.dump(parameters, f, default=float)
+    elif format == 'npz':
+        np.savez_compressed(fname, parameters=json.dumps(parameters, default=float), **table)
+    elif format == 'parquet':
+        if pyarrow is None:
+            raise ImportError('Writing parquet files requires pyarrow')
+        arrowtable = pyarrow.table(table).replace_schema_metadata({'parameters': json.dumps(parameters, default=float)})
+        pyarrow.parquet.write_table(arrowtable, fname)
+    else:
+        raise ValueError('Unknown results format: ' + str(format))
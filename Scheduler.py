@@ -0,0 +1,58 @@
+import numpy as np
+
+""" Timers for state changes that happen at a known future step, such as the end of the EIP of a midge or the end of the
+fed window after a bloodmeal. Instead of comparing a timestamp with the current step for every agent on every step, an
+event is put in the bucket of the step it is due and only the events of the current step are looked at. Events are
+never removed when they become invalid (a midge that dies while it is incubating, for example), every event carries the
+step it was scheduled at so its owner can tell a stale event apart and skip it when it fires.
+"""
+
+
+class TimingWheel:
+
+    def __init__(self, size=1024):
+        self.size = size  # Number of buckets, events further ahead than this wait in their bucket for another turn
+        self.buckets = [[] for i in range(size)]
+        self.count = 0  # Number of pending events
+
+    def __len__(self):
+        return self.count
+
+    # Schedule an event at step due for every index (the indices are copied), stamp is returned with the events when they
+    # fire
+    def schedule(self, due, indices, stamp):
+        if len(indices) == 0:
+            return
+        self.buckets[due % self.size].append((due, np.array(indices), np.full(len(indices), stamp)))
+        self.count += len(indices)
+
+    # Schedule an event for every index where every index has its own due step and stamp
+    def schedulemany(self, due, indices, stamps):
+        order = np.argsort(due, kind='stable')
+        due, indices, stamps = due[order], indices[order], stamps[order]
+
+        # One bucket entry for every distinct due step
+        starts = np.flatnonzero(np.r_[True, due[1:] != due[:-1]]) if len(due) else []
+        ends = np.r_[starts[1:], len(due)] if len(due) else []
+        for start, end in zip(starts, ends):
+            self.buckets[due[start] % self.size].append((int(due[start]), indices[start:end], stamps[start:end]))
+        self.count += len(indices)
+
+    # Remove and return the indices and stamps of every event due at step
+    def pop(self, step):
+        bucket = self.buckets[step % self.size]
+        due = [event for event in bucket if event[0] == step]
+        if len(due) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        self.buckets[step % self.size] = [event for event in bucket if event[0] != step]
+        indices = np.concatenate([event[1] for event in due])
+        stamps = np.concatenate([event[2] for event in due])
+        self.count -= len(indices)
+
+        return indices, stamps
+
+    # Remove every pending event
+    def clear(self):
+        self.buckets = [[] for i in range(self.size)]
+        self.count = 0
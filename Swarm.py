@@ -1,6 +1,22 @@
+import io
+import os
+import copy
+import json
 import numpy as np
-import csv
-from numba import jit, njit
+from Recorder import Recorder
+from Results import writeresults
+from Trajectory import exportpositions
+from Scheduler import TimingWheel
+from Profiler import Profiler
+from Movement import UniformMovement, generate_random_vector
+from HostGrid import HostGrid, cellindex, gridnearest
+from numba import njit
+from scipy.spatial import cKDTree
+
+# Bits of the MidgeSwarm status array
+INFECTED = 1  # The midge can transmit BTV
+INCUBATING = 2  # BTV is incubating inside the midge
+FED = 4  # The midge has had a bloodmeal within the last biterate steps
 
 """ This is the main swarm class, where all midges are simulated. This class holds all attributes of the midges and will
 be responsible for moving the host during its move function as well. Moving the time is done by calling the move() method
@@ -10,154 +26,402 @@ so be sure not to move the host on their own! This feature will be added later.
 
 class MidgeSwarm:
 
-    def __init__(self, envir, hostswarm, size=100, infected='random', midgedeath=True, dps=0.75, eip=21, pVtoH = 0.9, pHtoV = 0.14, savepositions=False, movehosts=False):
+    def __init__(self, envir, hostswarm, size=100, infected='random', midgedeath=True, dps=0.75, eip=21, pVtoH = 0.9, pHtoV = 0.14, savepositions=False, movehosts=False, recorder=None, engine='numpy', rng=None, precision='float64', profile=None, movement=None, hostindex='kdtree', adaptive=False, schedule=None):
 
         self.step = 0  # Initialize the step counter
         self.size = size  # Define the population size of the swarm object
-        self.pos_history = []  # Begin a list that tracks the history of midge positions
+        if np.dtype(precision) not in (np.float32, np.float64):
+            raise ValueError('precision must be float32 or float64')
+        self.precision = np.dtype(precision)  # Dtype of the positions and vectors of the midges
+        self.timedtype = np.dtype(np.int32 if self.precision == np.float32 else np.int64)  # Dtype of the step timestamps
+        self.status = np.zeros(self.size, dtype=np.uint8)  # INFECTED, INCUBATING and FED flags of every midge
         self.activeflightvelocity = 0.50  # (m/s) Define the average active velocity of a midge per second
         self.roamflightvelocity = 0.13  # (m/s) Define the average roaming velocity of a midge per second
         self.hostwalkvelocity = 0.1  # (m/s) Define the average walking velocity for a ruminant to move in a random walk
         self.detectiondistance = 300  # (m) Define the distance at which the midges can detect the host
         self.bitethresholddistance = self.activeflightvelocity  # (m) Define the distance at which a midge must be in order to bite the host
         self.eip = eip  # (days) Define the extrinsic incubation period (EIP)
-        self.midgebitesperstep = []  # Keep track of the midge bites each time step
-        self.totalinfectedmidges = []  # Keep track of the total number of infected midges
         self.infecteddeaths = []  # Keep track of the number of infected midges that die each step (only if midgedeath is True)
         self.uninfecteddeaths = []  # Keep track of the number of uninfected midges that die each step (only if midgedeath is True)
-        self.infectedbitesperstep = []  # Track the total number of bites from infected midges per step
-        self.btvincubating = np.full(self.size,
-                                     False)  # Define the array that tracks whether BTV is incubating inside the midge
         self.incubationstarttime = np.full(self.size,
-                                           0)  # Create an array that tracks when midges begin incubation for BTV
+                                           0, dtype=self.timedtype)  # Create an array that tracks when midges begin incubation for BTV
         self.envir = envir  # Attach the environment object to the swarm class
         self.hostswarm = hostswarm  # The midge swarm class will take the host swarm to know the locations and attributes of each host
+        self.rng = hostswarm.rng if rng is None else np.random.default_rng(rng)  # Random number generator of the swarm (shares the host generator by default)
         self.daylength = 300  # The length in minutes of a single day (note it is not the entire day, only the length of each period simulated
         self.biterate = 2 * self.daylength  # This variable determines how often a midge is expected to bite a host
-        self.timeoffeeding = np.random.randint(-self.biterate, 0,
-                                               self.size)  # List to keep track of the time when each midge has fed
+        self.bitingday = True  # Whether the hungry midges seek and bite a host on the current day
+        # Daily temperature schedule of the EIP, survival, bite interval and biting days (see Temperature.py), with None
+        # eip, dps and biterate stay constant and the midges bite every day
+        self.schedule = schedule
+        if schedule is not None:
+            self.biterates = schedule.biterates(self.daylength)  # Bite interval in steps of every day of the schedule
+            self.biterate = int(self.biterates[schedule.index(0)])
+            self.bitingday = bool(schedule.bitingdays[schedule.index(0)])
+        self.timeoffeeding = self.rng.integers(-self.biterate, 0,
+                                               self.size).astype(self.timedtype)  # List to keep track of the time when each midge has fed
         self.pVtoH = pVtoH  # Probability of transmission of BTV from a vector to the host
         self.pHtoV = pHtoV  # Probability of transmission of BTV from a host to the vector
         self.savepositions = savepositions # Save each midge's position history throughtout the simulation (MUST BE TRUE IF SAVING MIDGE POSITIONS)
         self.movehosts = movehosts # Track whether the hosts will also move in a random walk during the simulation period
+        self.engine = engine  # Either 'numpy' or 'numba', the numba engine runs the movement and bite detection as one compiled pass
+        self.profiler = Profiler(profile)  # Timings of the phases of move() (off unless profile or MIDGEPY_PROFILE is set)
+
+        # The recorder keeps the time series of the simulation, by default everything is kept in memory
+        self.recorder = Recorder() if recorder is None else recorder
+        self.recorder.addchannel('totalinfectedmidges')  # Total number of infected midges
+        self.recorder.addchannel('midgebitesperstep')  # Midge bites each time step
+        self.recorder.addchannel('infectedbitesperstep')  # Bites from infected midges each time step
+        self.recorder.addchannel('totalinfectedhost')  # Total number of infected host
+        if self.savepositions:
+            self.recorder.addchannel('positions', shape=(size, 2), dtype=np.float32)  # History of the midge positions
+            self.recorder.addchannel('hostpositions', shape=(hostswarm.size, 2), dtype=np.float32)  # History of the host positions
 
         self.midgedeath = midgedeath  # Enable this if you would like to simulate midges dying and being replaced by new ones
         self.dps = dps  # Daily Probability of Survival. Only enable if self.midgedeath is true
+        self.degreedays = None  # Degree-days of EIP accumulated by every midge, only used with a schedule
+        if schedule is not None:
+            self.dps = schedule.survival[schedule.index(0)]
+            self.degreedays = np.zeros(self.size)
 
         # Create a random positions array for the midges if desired, otherwise it is defined
-        self.positions = np.random.uniform(low=0.0, high=envir.length, size=(self.size, 2))
+        self.positions = self.randompositions(self.size)
+
+        # Movement policy of the roaming midges and walking host (see Movement.py), a uniformly random heading by default
+        self.movement = UniformMovement(envir) if movement is None else movement
+        self.randomvector = self.movement.propose(self.positions, self.rng)  # Array of random vector where the midges travel, updates every movement.refresh steps
+        # Spatial index used to find the closest host to each midge. 'kdtree' finds the closest host anywhere, 'grid' only
+        # searches the host within detectiondistance on a uniform grid (see HostGrid.py), which scales to large herds.
+        # With the grid, a midge that has no host within detectiondistance does not bite
+        if hostindex not in ('kdtree', 'grid'):
+            raise ValueError('hostindex must be kdtree or grid')
+        self.hostindex = hostindex
+        if hostindex == 'grid':
+            self.nearesthost = HostGridIndex(self.hostswarm, self.detectiondistance)
+        else:
+            self.nearesthost = NearestHostIndex(self.hostswarm)
+        self.closesthost = None  # Buffers for the numba engine, allocated on the first step
 
-        self.randomvector = generate_random_vector(self.envir.length, self.size,
-                                                   self.positions)  # Array of random vector where the midges travel, updates every few steps
+        # Adaptive stepping lets advance() coast the midges that cannot meet a host between two vector refreshes (see
+        # coast), it needs the range-limited grid search, static host and float64 positions, and cannot record the
+        # position of every midge at every step
+        if adaptive and (hostindex != 'grid' or savepositions or movehosts or self.precision != np.float64):
+            raise ValueError("adaptive stepping needs hostindex='grid', movehosts=False, savepositions=False and "
+                             "precision='float64'")
+        self.adaptive = adaptive
 
         # Create a random array of which midges are infected if desired, otherwise it is defined
-        if infected == 'random':
-            self.infected = np.random.choice([True, False], self.size, p=[0.01, 0.99])
+        if isinstance(infected, str) and infected == 'random':
+            self.infected = self.rng.random(self.size) < 0.01
         else:
             self.infected = infected
 
+        # Running totals of infected midges and inoculated host, kept up to date by move() and feed()
+        self.numinfected = np.count_nonzero(self.infected)
+        self.numinoculated = np.count_nonzero(self.hostswarm.incubationstarttime)
+
+        # Timers for the state changes that happen at a known step (see Scheduler.py), move() handles the events due
+        self.eiptimers = TimingWheel()  # End of the EIP of incubating midges
+        self.hungertimers = TimingWheel()  # End of the fed window of midges that have fed
+        self.hosttimers = TimingWheel()  # End of the incubation of inoculated host
+        self.rebuildtimers()
+
     # The step function that calculates all movement (dt is given in seconds)
     def move(self, dt=1):
 
-        if self.savepositions:
-            self.totalinfectedmidges.append(np.sum(self.infected))
+        self.recorder.record(self.step, 'totalinfectedmidges', self.numinfected)
 
-        # Update the infected midges to be those that have completed their EIP
-        self.infected = np.logical_or(self.infected, np.logical_and(self.incubationstarttime != 0, np.abs(
-            self.incubationstarttime - self.step) >= self.daylength * self.eip))
-
-        # Do the same for the hosts
-        self.hostswarm.infected = np.logical_or(self.hostswarm.infected, np.logical_and(
-            self.hostswarm.incubationstarttime != 0,
-            np.abs(self.hostswarm.incubationstarttime - self.step) >= (self.daylength * self.hostswarm.incubationtime)))
+        self.firetimers()
 
         # Move the host once every day
         if self.step % self.daylength == 0:
-            self.hostswarm.move()
-
-            if self.step == 0:
-                self.infecteddeaths.append(0)
-                self.uninfecteddeaths.append(0)
-
-            # Replace some midges once per day if self.midgedeath is enabled
-            if self.midgedeath:
-                survivingmidges = np.random.choice([True, False], self.size, p=[self.dps, 1 - self.dps])
-                newpositions = np.random.uniform(low=0.0, high=self.envir.length, size=(self.size, 2))
-
-                self.infecteddeaths.append(np.sum(~survivingmidges * self.infected))
-                self.uninfecteddeaths.append(np.sum(~survivingmidges * ~self.infected))
-
-                # Give the midges new positions and reset all other parameters
-                self.btvincubating *= survivingmidges
-                self.infected *= survivingmidges
-                self.incubationstarttime *= survivingmidges
-                survivingmidges = np.expand_dims(survivingmidges, 1)
-                self.positions = self.positions * survivingmidges + newpositions * (~survivingmidges)
-
-        # A new random vector is generated every 30 minutes for the midges to travel in
-        if self.step % 30 == 0:
-            self.randomvector = generate_random_vector(self.envir.length, self.size, self.positions)
-
-        # Move hosts in a random walk if so desired at walk velocity
-        if self.movehosts:
-            self.hostswarm.positions = self.hostswarm.positions + generate_random_vector(self.envir.length, self.hostswarm.size, self.hostswarm.positions) * self.hostwalkvelocity * dt
-
-        # Calculate which midges have fed lately by tracking when the last bloodmeal was
-        self.fed = ((self.step - self.timeoffeeding) < self.biterate)
-
-        # Find the matrix of vectors from each midge to each host (self.size x self.hostswarm.size matrix)
-        targetmatrix = self.calculate_target_matrix()
-
-        # TODO: REPLACE WITH ACCELERATED FUNCTION
+            with self.profiler.phase('daily'):
+                if self.schedule is not None:
+                    self.applyschedule()
 
-        # Calculate the matrix of distances from each midge to each host and find the closest host
-        distancematrix = np.sqrt(np.square(targetmatrix[:, 0, :, 0]) + np.square(targetmatrix[:, 1, :, 1]))
+                self.hostswarm.move()
 
-        closesthost = np.argmin(distancematrix, axis=1)
+                if self.step == 0:
+                    self.infecteddeaths.append(0)
+                    self.uninfecteddeaths.append(0)
 
-        # Find the directions for each midge by finding vector from the closest host
-        midgedirections = np.empty(shape=(self.size, 2), dtype=float)
+                # Replace some midges once per day if self.midgedeath is enabled
+                if self.midgedeath:
+                    # A midge dies if its uniform draw is above dps, only the dead midges draw a new position
+                    dead = np.flatnonzero(self.rng.random(self.size) >= self.dps)
 
-        for i in range(self.size):
-            midgedirections[i] = (targetmatrix[i, 0, closesthost[i], 0], targetmatrix[i, 1, closesthost[i], 1])
+                    self.infecteddeaths.append(np.count_nonzero(self.status[dead] & INFECTED))
+                    self.uninfecteddeaths.append(dead.size - self.infecteddeaths[-1])
+                    self.numinfected -= self.infecteddeaths[-1]
 
-        # Calculate the distance that each midge must travel to reach the closest host
-        hostdistances = np.linalg.norm(midgedirections, axis=1)
+                    # Give the midges new positions and reset all other parameters
+                    self.status[dead] &= ~np.uint8(INFECTED | INCUBATING)
+                    self.incubationstarttime[dead] = 0
+                    self.positions[dead] = self.randompositions(dead.size)
 
-        # The list of midges that are within the detection distance of their closest host and have not fed
-        detectinghost = (hostdistances < self.detectiondistance) * ~self.fed
+        # A new random vector is generated every movement.refresh steps (30 minutes) for the midges to travel in
+        if self.step % self.movement.refresh == 0:
+            with self.profiler.phase('randomvector'):
+                self.randomvector = self.movement.propose(self.positions, self.rng)
+            self.profiler.allocation('randomvector', self.randomvector)
 
-        # Calculate the new positions by using the flightvelocity variable
-        self.positions = self.get_positions() + self.activeflightvelocity * dt * ((np.expand_dims(detectinghost, 1) *
-                                                                                   np.divide(midgedirections,
-                                                                                             np.expand_dims(
-                                                                                                 hostdistances, 1),
-                                                                                             out=np.zeros_like(
-                                                                                                 midgedirections),
-                                                                                             where=np.expand_dims(
-                                                                                                 hostdistances,
-                                                                                                 1) != 0)) + (
-                                                                                          self.randomvector * ~np.expand_dims(
-                                                                                      detectinghost, 1)))
+        self.walkhosts(dt)
 
-        # Calculate which midges will feed and the results of their feeding
-        self.feed(closesthost, hostdistances, dt)
+        if self.engine == 'numba':
+            self.movenumba(dt)
+        else:
+            self.movenumpy(dt)
 
-        # Append the position history to pos_history
+        # Record the position history
         if self.savepositions:
-            self.pos_history.append(self.get_positions())
-            self.hostswarm.pos_history.append(self.hostswarm.get_positions())
+            with self.profiler.phase('record'):
+                self.recorder.record(self.step, 'positions', self.get_positions())
+                self.recorder.record(self.step, 'hostpositions', self.hostswarm.get_positions())
 
         # Increment the step counter
         self.step += 1
 
-    # Returns the matrix of vectors from every midge to every host (midges x host x 2) size
-    def calculate_target_matrix(self):
-        pos = self.hostswarm.get_positions()
+    # Take the parameters of the new day from the schedule and advance the EIP of the incubating midges by the
+    # degree-days of the day that has just ended, the midges that reach the EIP degree-days become infected
+    def applyschedule(self):
+        day = self.step // self.daylength
+        today = self.schedule.index(day)
+        self.dps = self.schedule.survival[today]
+        self.biterate = int(self.biterates[today])
+        self.bitingday = bool(self.schedule.bitingdays[today])
+        if day == 0:
+            return
+
+        # A midge that started its incubation during the day only gains the part of the day it was incubating for
+        incubating = np.flatnonzero((self.incubationstarttime != 0) & (self.status & INFECTED == 0))
+        fraction = np.minimum((self.step - self.incubationstarttime[incubating]) / self.daylength, 1)
+        self.degreedays[incubating] += fraction * self.schedule.degreedays[self.schedule.index(day - 1)]
+
+        completed = incubating[self.degreedays[incubating] >= self.schedule.eipdegreedays]
+        self.numinfected += completed.size
+        self.status[completed] |= INFECTED
+
+    # Apply the state changes of the timers due this step
+    def firetimers(self):
+        with self.profiler.phase('timers'):
+            # Midges that complete their EIP this step become infected, the event of a midge that has died since is stale
+            midges, stamps = self.eiptimers.pop(self.step)
+            midges = midges[(self.incubationstarttime[midges] == stamps) & (self.status[midges] & INFECTED == 0)]
+            self.numinfected += midges.size
+            self.status[midges] |= INFECTED
+
+            # Do the same for the hosts
+            hosts, stamps = self.hosttimers.pop(self.step)
+            self.hostswarm.infected[hosts[self.hostswarm.incubationstarttime[hosts] == stamps]] = True
+
+            # Midges whose last bloodmeal was biterate steps ago are hungry again
+            midges, stamps = self.hungertimers.pop(self.step)
+            self.status[midges[self.timeoffeeding[midges] == stamps]] &= ~np.uint8(FED)
+
+    # Move hosts in a random walk if so desired at walk velocity
+    def walkhosts(self, dt):
+        if self.movehosts:
+            with self.profiler.phase('movehosts'):
+                positions = self.hostswarm.positions + self.movement.propose(self.hostswarm.positions, self.rng) * self.hostwalkvelocity * dt
+                self.envir.confine(positions, self.rng)
+                self.hostswarm.set_positions(positions)
+
+    # Move the swarm by the given number of steps. With adaptive stepping the steps between two vector refreshes or day
+    # boundaries are coasted (see coast), otherwise every step is a call to move()
+    def advance(self, steps, dt=1):
+        end = self.step + steps
+        while self.step < end:
+            if not self.adaptive or self.step % self.movement.refresh == 0 or self.step % self.daylength == 0:
+                self.move(dt)
+                continue
+
+            # Coast up to the next refresh or day boundary, which is taken by move() again
+            boundary = min(self.step - self.step % self.movement.refresh + self.movement.refresh,
+                           self.step - self.step % self.daylength + self.daylength, end)
+            self.coast(boundary - self.step, dt)
+
+    # Take the given number of steps, none of which refreshes the random vectors or is a day boundary. Between those
+    # events a midge that is fed or has no host within detectiondistance flies in a straight line along its random
+    # vector, so the step at which every midge can first meet a host is worked out once for the whole window. Until then
+    # the midge is left in place and it is moved analytically, only the midges that may be closing on a host (and the
+    # lookup midges of the bite check) are stepped every minute. The positions match move() up to rounding (about 1e-9
+    # m). Should that rounding ever tip a seeking midge over a bite threshold the runs part ways from there on, they stay
+    # statistically equivalent but not step for step. Walking host are not supported: a midge circling a moving host
+    # turns such rounding into different bites within a few hundred steps. Neither are float32 positions, move() rounds
+    # them every step and the coasted midges end up to about 0.6 m away from where it puts them
+    def coast(self, steps, dt=1):
+        flightstep = self.activeflightvelocity * dt
+
+        with self.profiler.phase('entry'):
+            # A fed midge cannot meet a host before its hunger timer fires, the lookup midges of the bite check matter
+            # whether they are fed or not. On a day without biting no midge meets a host (the window never crosses a day
+            # boundary)
+            lowerbound = np.zeros(self.size, dtype=np.int64)
+            fed = np.flatnonzero(self.status & FED)
+            lowerbound[fed] = np.minimum(self.timeoffeeding[fed] + self.biteintervals()[fed] - self.step, steps)
+            lowerbound[:self.hostswarm.size] = 0
+            if not self.bitingday:
+                lowerbound[:] = steps
+
+            # The search radius grows by one flight step so that rounding never lets a midge meet a host before the step
+            # worked out here
+            radius = self.detectiondistance + flightstep
+            grid = self.hostswarm.cellindex(self.nearesthost.radius)
+            entry = entrysteps(self.positions, self.randomvector, self.hostswarm.get_positions(), lowerbound, steps,
+                               flightstep, radius, grid.head, grid.next, grid.cellsize, grid.cells, grid.period)
+
+            # A midge that would leave the domain is stepped from its last step inside on, so the boundary policy
+            # applies to it as it does in move()
+            if self.envir.boundary is not None:
+                np.minimum(entry, exitsteps(self.positions, self.randomvector, steps, flightstep, self.envir.length),
+                           out=entry)
+            order = np.argsort(entry, kind='stable')
+            entered = np.searchsorted(entry[order], np.arange(steps), side='right')
+
+        activemask = np.zeros(self.size, dtype=bool)
+        active = 0
+        midges = order[:0]
+        for t in range(steps):
+            self.recorder.record(self.step, 'totalinfectedmidges', self.numinfected)
+            self.firetimers()
+
+            # Bring the midges that may meet a host from this step on to their current position
+            if entered[t] > active:
+                new = order[active:entered[t]]
+                self.positions[new] += t * flightstep * self.randomvector[new]
+                activemask[new] = True
+                midges = np.flatnonzero(activemask)
+                active = entered[t]
+
+            self.movenumba(dt, midges)
+            self.step += 1
+
+        # Every other midge flew the whole window along its random vector
+        coasting = order[active:]
+        self.positions[coasting] += steps * flightstep * self.randomvector[coasting]
+
+    # Returns the timings of the phases of move() and the sizes of its temporaries (see Profiler.py), the report is empty
+    # unless profiling was switched on
+    def perf_report(self):
+        return self.profiler.report()
+
+    # Move the swarm until predicate(self) returns an outcome other than -1, or until max_steps steps have been taken.
+    # Returns the outcome (-1 if max_steps was reached first) and the step it happened at
+    def run_until(self, predicate, max_steps, dt=1):
+        for i in range(max_steps):
+            outcome = predicate(self)
+            if outcome != -1:
+                return int(outcome), self.step
+            self.move(dt)
+
+        return int(predicate(self)), self.step
+
+    # Number of steps from the start of an incubation in a midge to the end of its EIP
+    def eipsteps(self):
+        return max(int(np.ceil(self.daylength * self.eip)), 1)
+
+    # Number of steps from the inoculation of a host to the end of its incubation
+    def hostincubationsteps(self):
+        return max(int(np.ceil(self.daylength * self.hostswarm.incubationtime)), 1)
+
+    # Returns the number of steps every midge stays fed after its last bloodmeal, with a schedule it is the bite interval
+    # of the day the midge fed on
+    def biteintervals(self):
+        if self.schedule is None:
+            return np.full(self.size, self.biterate)
+        return self.biterates[self.schedule.index(np.maximum(self.timeoffeeding, 0) // self.daylength)]
+
+    # Rebuild the fed state and every pending timer from the state arrays (when the swarm is created or restored)
+    def rebuildtimers(self):
+        biteintervals = self.biteintervals()
+        self.fed = (self.step - self.timeoffeeding) < biteintervals
+        fed = np.flatnonzero(self.status & FED)
+        self.hungertimers.clear()
+        self.hungertimers.schedulemany(self.timeoffeeding[fed] + biteintervals[fed], fed, self.timeoffeeding[fed])
+
+        # A start time of 0 means no incubation, with a schedule the EIP is tracked in degree-days instead of timers
+        incubating = np.flatnonzero((self.incubationstarttime != 0) & (self.status & INFECTED == 0))
+        if self.schedule is not None:
+            incubating = incubating[:0]
+        starts = self.incubationstarttime[incubating]
+        self.eiptimers.clear()
+        self.eiptimers.schedulemany(np.maximum(starts + self.eipsteps(), self.step), incubating, starts)
+
+        incubating = np.flatnonzero((self.hostswarm.incubationstarttime != 0) & ~self.hostswarm.infected)
+        starts = self.hostswarm.incubationstarttime[incubating]
+        self.hosttimers.clear()
+        self.hosttimers.schedulemany(np.maximum(starts + self.hostincubationsteps(), self.step), incubating, starts)
+
+    # Movement and feeding for a single step using NumPy array operations
+    def movenumpy(self, dt):
+        flightstep = self.activeflightvelocity * dt
+
+        # Only the hungry midges look for a host, the fed midges (and every midge on a day without biting) just follow
+        # their random vector
+        with self.profiler.phase('nearesthost'):
+            hungry = np.flatnonzero((self.status & FED == 0) & self.bitingday)
+            closesthost, midgedirections, hostdistances = self.nearesthost.query(self.positions[hungry])
+
+            # NOTE: a midge bites if the distance of the midge whose index is its closest host is within reach, this
+            # lookup by host is kept as-is so that results match the published model (it needs the first
+            # hostswarm.size midges). Host without a midge of the same index, and the extra last entry looked up by
+            # midges without a host in range (host -1), are never within reach
+            lookupdistances = np.full(self.hostswarm.size + 1, np.inf)
+            lookup = self.positions[:self.hostswarm.size]
+            lookupdistances[:lookup.shape[0]] = self.nearesthost.query(lookup)[2]
+        self.profiler.allocation('midgedirections', midgedirections)
+
+        with self.profiler.phase('position'):
+            # The hungry midges that are within the detection distance of their closest host fly towards it
+            detecting = hostdistances < self.detectiondistance
+            seeking = hungry[detecting]
+            directions = np.divide(midgedirections[detecting], hostdistances[detecting, None],
+                                   out=np.zeros_like(midgedirections[detecting]),
+                                   where=hostdistances[detecting, None] != 0)
+            seekingpositions = self.positions[seeking] + flightstep * directions
+
+            # Every other midge (most of them) is moved with a single vector add
+            self.positions += flightstep * self.randomvector
+            self.positions[seeking] = seekingpositions
+
+        with self.profiler.phase('boundary'):
+            self.envir.confine(self.positions, self.rng)
 
-        answer = -np.subtract.outer(self.get_positions(), pos)
+        # Calculate which midges will feed and the results of their feeding
+        with self.profiler.phase('feed'):
+            biting = lookupdistances[closesthost] < self.bitethresholddistance * dt
+            self.feed(hungry[biting], closesthost[biting])
+
+    # Movement and feeding for a single step using the compiled kernel, the kernel writes into preallocated buffers. With
+    # the grid host index, midges (sorted indices) limits the step to those midges, the midges left out must be fed or
+    # have no host within detectiondistance (see coast)
+    def movenumba(self, dt, midges=None):
+
+        if self.closesthost is None or self.closesthost.shape[0] != self.size:
+            self.closesthost = np.empty(self.size, dtype=np.int64)  # Host bitten by each biting midge
+            self.feedingmidges = np.empty(self.size, dtype=np.int64)  # Indices of the biting midges
+            self.allmidges = np.arange(self.size)  # Indices of every midge
+
+        with self.profiler.phase('fusedstep'):
+            if self.hostindex == 'grid':
+                grid = self.hostswarm.cellindex(self.nearesthost.radius)
+                bites = fusedgridstep(self.positions, self.randomvector, self.hostswarm.get_positions(), self.status,
+                                      self.allmidges if midges is None else midges, self.bitingday,
+                                      self.nearesthost.radius, self.activeflightvelocity * dt,
+                                      self.bitethresholddistance * dt, self.feedingmidges, self.closesthost, grid.head,
+                                      grid.next, grid.nearby, grid.cellsize, grid.cells, grid.period)
+            else:
+                bites = fusedstep(self.positions, self.randomvector, self.hostswarm.get_positions(), self.status,
+                                  self.bitingday, self.detectiondistance, self.activeflightvelocity * dt,
+                                  self.bitethresholddistance * dt, self.feedingmidges, self.closesthost,
+                                  self.envir.period)
+
+        with self.profiler.phase('boundary'):
+            self.envir.confine(self.positions, self.rng)
 
-        return answer
+        # Calculate which midges will feed and the results of their feeding
+        with self.profiler.phase('feed'):
+            self.feed(self.feedingmidges[:bites], self.closesthost[:bites])
 
     # Returns the numpy array of positions
     def get_positions(self):
@@ -167,115 +431,408 @@ class MidgeSwarm:
     def get_infected(self):
         return self.infected
 
+    # The flags are stored as bits of self.status, these properties return them as new boolean arrays (so writing to an
+    # element of the returned array does not change the swarm) and set them from boolean arrays
+    @property
+    def infected(self):
+        return self.status & INFECTED != 0
+
+    @infected.setter
+    def infected(self, infected):
+        self.setflag(INFECTED, infected)
+
+    @property
+    def btvincubating(self):
+        return self.status & INCUBATING != 0
+
+    @btvincubating.setter
+    def btvincubating(self, btvincubating):
+        self.setflag(INCUBATING, btvincubating)
+
+    @property
+    def fed(self):
+        return self.status & FED != 0
+
+    @fed.setter
+    def fed(self, fed):
+        self.setflag(FED, fed)
+
+    # Set the given status bit of every midge from a boolean array
+    def setflag(self, flag, values):
+        self.status = np.where(np.asarray(values, dtype=bool), self.status | flag, self.status & ~np.uint8(flag))
+
+    # Returns count random positions in the domain with the precision of the swarm
+    def randompositions(self, count):
+        return self.rng.random((count, 2), dtype=self.precision) * self.precision.type(self.envir.length)
+
     # Returns the HostSwarm object
     def get_hostswarm(self):
         return self.hostswarm
 
     # Returns the full position history of the midges
     def get_full_pos_history(self):
-        return [*self.pos_history, self.get_positions()]
+        return [*self.recorder.get('positions'), self.get_positions()]
 
-    def feed(self, closesthost, hostdistances, dt):
+    # Feeding for the midges in biting (indices, in increasing order) that bite the host in bitten this step
+    def feed(self, biting, bitten):
 
-        # Find which midges are close enough to the host to bite them and they have not recently fed
-        feedingmidges = (hostdistances[closesthost] < self.bitethresholddistance * dt) & ~self.fed
+        # Only the midges that bite need random draws, so the cost of feeding scales with the number of bites
+        draws = self.rng.random((2, biting.size))
+        self.profiler.allocation('feeddraws', draws)
+        bitinginfected = self.status[biting] & INFECTED != 0
 
-        if self.savepositions:
-            self.infectedbitesperstep.append(np.sum(feedingmidges * self.infected))
+        self.recorder.record(self.step, 'infectedbitesperstep', np.count_nonzero(bitinginfected))
 
         # TODO: Add consideration for midges already infected
-        # The midges will begin BTV incubation if they are feeding and the closest host is infected, do the same for the host
-        newincubation = np.random.choice([True, False], self.size, p=[self.pHtoV, 1 - self.pHtoV]) * (
-                feedingmidges & self.hostswarm.infected[closesthost])
-
-        # Start incubation in the midges if they have not already begun
-        self.incubationstarttime[newincubation & ~self.btvincubating] = self.step
+        # The midges will begin BTV incubation with probability pHtoV if they are feeding and the closest host is infected
+        newincubation = biting[(draws[0] < self.pHtoV) & self.hostswarm.infected[bitten]]
+
+        # Start incubation in the midges if they have not already begun (a start time of 0 means no incubation, so
+        # incubations that start on the first step never end)
+        started = newincubation[self.status[newincubation] & INCUBATING == 0]
+        self.incubationstarttime[started] = self.step
+        if self.schedule is not None:
+            self.degreedays[started] = 0
+        elif self.step != 0:
+            self.eiptimers.schedule(self.step + self.eipsteps(), started, self.step)
 
         # Add the newly incubating midges to the list of btvincubating midges
-        self.btvincubating = np.logical_or(self.btvincubating, newincubation)
+        self.status[newincubation] |= INCUBATING
+
+        # A bite from an infected midge inoculates the host with probability pVtoH (if it has not already been inoculated)
+        infectious = (draws[1] < self.pVtoH) & bitinginfected
+        inoculated = np.unique(bitten[infectious])
+        inoculated = inoculated[self.hostswarm.incubationstarttime[inoculated] == 0]
+        self.hostswarm.incubationstarttime[inoculated] = self.step
+        if self.step != 0:
+            self.numinoculated += inoculated.size
+            self.hosttimers.schedule(self.step + self.hostincubationsteps(), inoculated, self.step)
+
+        # Update time of feeding to the current step for the midges which have just fed, they are fed for biterate steps
+        self.timeoffeeding[biting] = self.step
+        self.status[biting] |= FED
+        self.hungertimers.schedule(self.step + self.biterate, biting, self.step)
+
+        # Record the midge bites for this time step and total infected host
+        self.recorder.record(self.step, 'midgebitesperstep', biting.size)
+        self.recorder.record(self.step, 'totalinfectedhost', self.hostswarm.infected.sum())
+
+    # Write the per-step results to a CSV file, the run parameters are saved once in a .json file next to it
+    def writetocsv(self, trial=None, fname='Results/midgesim'):
+        self.writeresults(trial=trial, fname=fname, format='csv')
 
-        # Create the probability of infection array that determines which host will become infected if bitten during this timestep
-        hostinfectedprob = np.random.rand(self.size) < self.pVtoH
-        # Track which host become inoculated (if they are bitten, midge is infected, probability is favorable, and have not already been inoculated)
-        # for i in range(self.size):
-        #     if feedingmidges[i] & self.infected[i] & infectedprob[i] & (self.hostswarm.incubationstarttime[closesthost[i]] == 0):
-        #         # The host can be infected with probability infectedprob from a single bite from an infected midge
-        #         self.hostswarm.incubationstarttime[closesthost[i]] = self.step
+    # Write the per-step results in the given format ('csv', 'npz' or 'parquet'), see Results.py
+    def writeresults(self, trial=None, fname='Results/midgesim', format='csv'):
 
-        self.hostswarm.incubationstarttime = determineincubation(self.step, self.size, feedingmidges, self.infected,
-                                                                 hostinfectedprob, self.hostswarm.incubationstarttime,
-                                                                 closesthost)
+        # The daily survival changes every day with a schedule, the file is named after the schedule instead
+        if self.schedule is None:
+            fname = fname + 'DPS' + str(int(100*self.dps)) + 'Trial' + str(trial) + '.' + format
+        else:
+            fname = fname + 'Schedule' + self.schedule.key() + 'Trial' + str(trial) + '.' + format
 
-        # Update time of feeding to the current step for the midges which have just fed
-        self.timeoffeeding[feedingmidges] = self.step
+        writeresults(self, fname, format=format)
+        self.recorder.close()
 
-        # Append the midge bites for this time step and total infected midges
-        if self.savepositions:
-            self.midgebitesperstep.append(feedingmidges.sum())
+    # Save the midge and host position histories as trajectory files (see Trajectory.py), file names ending in .csv are
+    # also converted to CSV
+    def SavePositions(self, fnamemidge, fnamehost):
+        exportpositions(fnamemidge, self.recorder.get('positions'), label='Midge', stride=self.recorder.stride,
+                        daylength=self.daylength, length=self.envir.length)
+        exportpositions(fnamehost, self.recorder.get('hostpositions'), label='Host', stride=self.recorder.stride,
+                        daylength=self.daylength, length=self.envir.length)
+        self.recorder.close()
+
+    # Returns the full state of the swarm and its hosts, including the recorded time series and the state of the random
+    # number generator, as a compressed binary blob. A swarm restored from it continues exactly as this one would
+    def snapshot(self):
+        state = {'step': self.step, 'positions': self.positions, 'randomvector': self.randomvector,
+                 'timeoffeeding': self.timeoffeeding, 'incubationstarttime': self.incubationstarttime,
+                 'status': self.status, 'numinfected': self.numinfected,
+                 'numinoculated': self.numinoculated, 'infecteddeaths': np.asarray(self.infecteddeaths, dtype=np.int64),
+                 'uninfecteddeaths': np.asarray(self.uninfecteddeaths, dtype=np.int64),
+                 'hostpositions': self.hostswarm.positions, 'hostinfected': self.hostswarm.infected,
+                 'hostincubationstarttime': self.hostswarm.incubationstarttime,
+                 'rngstate': json.dumps({'midges': self.rng.bit_generator.state,
+                                         'hosts': self.hostswarm.rng.bit_generator.state})}
+        if self.degreedays is not None:
+            state['degreedays'] = self.degreedays
+        for name in self.recorder.channels:
+            state['recorder_' + name] = self.recorder.get(name)
+
+        blob = io.BytesIO()
+        np.savez_compressed(blob, **state)
+        return blob.getvalue()
+
+    # Continue from a snapshot. The swarm must have been created with the same size, host size and parameters as the
+    # swarm the snapshot was taken from. If rngstate is False the random number generators are left as they are
+    def restore(self, blob, rngstate=True):
+        with np.load(io.BytesIO(blob)) as state:
+            if state['positions'].shape[0] != self.size or state['hostpositions'].shape[0] != self.hostswarm.size:
+                raise ValueError('The snapshot was taken from a swarm of a different size')
+
+            self.step = int(state['step'])
+            self.positions = state['positions'].astype(self.precision)
+            self.randomvector = state['randomvector'].astype(self.precision)
+            self.timeoffeeding = state['timeoffeeding'].astype(self.timedtype)
+            self.incubationstarttime = state['incubationstarttime'].astype(self.timedtype)
+            self.status = state['status']
+            self.numinfected = int(state['numinfected'])
+            self.numinoculated = int(state['numinoculated'])
+            self.infecteddeaths = state['infecteddeaths'].tolist()
+            self.uninfecteddeaths = state['uninfecteddeaths'].tolist()
+            if self.schedule is not None:
+                # The parameters of the day of the last step taken, the next day boundary takes them from the schedule
+                self.degreedays = state['degreedays'] if 'degreedays' in state else np.zeros(self.size)
+                today = self.schedule.index(max(self.step - 1, 0) // self.daylength)
+                self.dps = self.schedule.survival[today]
+                self.biterate = int(self.biterates[today])
+                self.bitingday = bool(self.schedule.bitingdays[today])
+
+            self.hostswarm.set_positions(state['hostpositions'])
+            self.hostswarm.infected = state['hostinfected']
+            self.hostswarm.incubationstarttime = state['hostincubationstarttime']
+
+            for name in self.recorder.channels:
+                self.recorder.load(name, state['recorder_' + name])
+
+            if rngstate:
+                rngstate = json.loads(str(state['rngstate']))
+                self.hostswarm.rng.bit_generator.state = rngstate['hosts']
+                self.rng.bit_generator.state = rngstate['midges']
+
+        # The timers are not part of the snapshot, they follow from the restored state
+        self.rebuildtimers()
+
+    # Returns replicates copies of the swarm, each with its own hosts, that continue from the current state of this
+    # swarm (for example many continuations of one burned-in swarm). Every copy is of the same class as this swarm and
+    # gets independent random streams spawned from the generators of this swarm, a recorder with the same stride holding
+    # the rows recorded so far (in a forkN directory under the recorder path if it is on disk) and the same profiling
+    # setting. The environment, the movement policy (and its read-only map) and the schedule are shared
+    def fork(self, replicates):
+        rngs = self.rng.spawn(replicates)
+        hostrngs = self.hostswarm.rng.spawn(replicates)
+        shared = [self.envir, self.movement, *vars(self.movement).values(), self.schedule]
+
+        forks = []
+        for i in range(replicates):
+            path = None if self.recorder.path is None else os.path.join(self.recorder.path, 'fork' + str(i))
+            memo = {id(obj): obj for obj in shared}
+            memo[id(self.recorder)] = self.recorder.copy(path)
+            memo[id(self.profiler)] = Profiler(self.profiler.enabled)
+
+            swarm = copy.deepcopy(self, memo)
+            swarm.rng = rngs[i]
+            swarm.hostswarm.rng = hostrngs[i]
+            forks.append(swarm)
+
+        return forks
+
+
+""" The ensemble class simulates many independent replicates of a small midge swarm at once. Every array carries the
+replicate as its leading axis so that one call to move() advances all replicates with a handful of array operations. Each
+replicate has its own hosts, but all replicates share the environment and the step counter.
+"""
 
-        self.hostswarm.totalinfectedhost.append(self.hostswarm.infected.sum())
 
-    def writetocsv(self, trial=None, fname='Results/midgesim'):
+class MidgeEnsemble:
 
-        fname = fname + 'DPS' + str(int(100*self.dps)) + 'Trial' + str(trial) + '.csv'
+    def __init__(self, envir, replicates, size=100, hostsize=100, infected='random', hostinfected='random',
+                 midgedeath=True, dps=0.75, eip=21, pVtoH=0.9, pHtoV=0.14, incubationtime=2, movehosts=False, rng=None):
 
-        with open(fname, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=',')
-            writer.writerow(
-                ['Step', 'Day', 'Infected Midges', 'Infected Midges %', 'Infected Host', 'Infected Host %',
-                 'Midge Bites', 'Infected Midge Bites',
-                 'VF', 'VR', 'DD', 'EIP', 'PVTH', 'PHTV', 'DPS', 'PD', 'BR',
-                 'MDR', 'IIM', 'Infected Deaths', 'Uninfected Deaths'])
-            for i in range(self.step):
-                if self.midgedeath:
-                    writer.writerow([i, i / float(self.daylength), self.totalinfectedmidges[i],
-                                     self.totalinfectedmidges[i] / self.size * 100,
-                                     self.hostswarm.totalinfectedhost[i],
-                                     self.hostswarm.totalinfectedhost[i] / self.hostswarm.size * 100,
-                                     self.midgebitesperstep[i], self.infectedbitesperstep[i], self.activeflightvelocity,
-                                     self.roamflightvelocity, self.detectiondistance, self.eip, self.pVtoH,
-                                     self.pHtoV, self.dps, self.hostswarm.size, self.biterate,
-                                     self.size // self.hostswarm.size,
-                                     self.totalinfectedmidges[0], self.infecteddeaths[i // self.daylength],
-                                     self.uninfecteddeaths[i // self.daylength]])
-
-                else:
-                    writer.writerow([i, i / float(self.daylength), self.totalinfectedmidges[i],
-                                     self.totalinfectedmidges[i] / self.size * 100,
-                                     self.hostswarm.totalinfectedhost[i],
-                                     self.hostswarm.totalinfectedhost[i] / self.hostswarm.size * 100,
-                                     self.midgebitesperstep[i], self.activeflightvelocity, self.roamflightvelocity,
-                                     self.detectiondistance, self.eip, self.pVtoH,
-                                     self.pHtoV, self.dps, self.hostswarm.size, self.biterate,
-                                     self.size // self.hostswarm.size,
-                                     self.totalinfectedmidges[0]])
-        return
+        self.step = 0  # Initialize the step counter (shared by all replicates)
+        self.replicates = replicates  # Number of independent replicates simulated together
+        self.size = size  # Population size of the midge swarm in each replicate
+        self.hostsize = hostsize  # Population size of the host swarm in each replicate
+        self.activeflightvelocity = 0.50  # (m/s) Define the average active velocity of a midge per second
+        self.roamflightvelocity = 0.13  # (m/s) Define the average roaming velocity of a midge per second
+        self.hostwalkvelocity = 0.1  # (m/s) Define the average walking velocity for a ruminant to move in a random walk
+        self.detectiondistance = 300  # (m) Define the distance at which the midges can detect the host
+        self.bitethresholddistance = self.activeflightvelocity  # (m) Define the distance at which a midge must be in order to bite the host
+        self.envir = envir  # Attach the environment object to the ensemble
+        self.daylength = 300  # The length in minutes of a single day
+        self.biterate = 2 * self.daylength  # This variable determines how often a midge is expected to bite a host
+        self.pHtoV = pHtoV  # Probability of transmission of BTV from a host to the vector
+        self.incubationtime = incubationtime  # (days) Incubation time of BTV in the host
+        self.midgedeath = midgedeath  # Enable this to replace dead midges with new ones once per day
+        self.movehosts = movehosts  # Track whether the hosts will also move in a random walk
+        self.rng = np.random.default_rng(rng)  # Random number generator shared by all replicates
+
+        # Per replicate parameters, a scalar is used for every replicate
+        self.dps = np.broadcast_to(np.asarray(dps, dtype=float), (replicates,)).copy()
+        self.eip = np.broadcast_to(np.asarray(eip, dtype=float), (replicates,)).copy()
+        self.pVtoH = np.broadcast_to(np.asarray(pVtoH, dtype=float), (replicates,)).copy()
+
+        # Replicates that have finished are retired and no longer advanced by move()
+        self.active = np.full(replicates, True)
+        self.outcome = np.full(replicates, -1)  # Outcome of each replicate from run_until (-1 while undecided)
+        self.finishstep = np.full(replicates, -1)  # Step at which each replicate reached its outcome
+
+        # Midge state, (replicates x size) arrays
+        self.positions = self.rng.uniform(low=0.0, high=envir.length, size=(replicates, size, 2))
+        self.randomvector = self.generate_random_vectors(self.positions)
+        self.btvincubating = np.full((replicates, size), False)
+        self.incubationstarttime = np.full((replicates, size), 0)
+        self.timeoffeeding = self.rng.integers(-self.biterate, 0, (replicates, size))
+
+        if isinstance(infected, str) and infected == 'random':
+            self.infected = self.rng.random((replicates, size)) < 0.01
+        else:
+            self.infected = np.broadcast_to(infected, (replicates, size)).copy()
 
-    def SavePositions(self, fnamemidge, fnamehost):
-        # SAVE MIDGE POSITIONS
-        with open(fnamemidge, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=',')
-            header = ['Step', 'Midge', 'Midge X', 'Midge Y']
-            writer.writerow(header)
-            for i in range(self.step):
-                for j in range(self.size):
-                    writer.writerow([i, j, self.pos_history[i][j][0], self.pos_history[i][j][1]])
-
-        # SAVE DEER POSITIONS
-        with open(fnamehost, 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile, delimiter=',')
-            header = ['Step', 'Host', 'Host X', 'Host Y']
-            writer.writerow(header)
-            for i in range(self.step):
-                for j in range(self.hostswarm.size):
-                    writer.writerow([i, j, self.hostswarm.pos_history[i][j][0], self.hostswarm.pos_history[i][j][1]])
-
-        return
+        # Host state, (replicates x hostsize) arrays
+        self.hostpositions = self.rng.uniform(low=0.0, high=envir.length, size=(replicates, hostsize, 2))
+        self.hostincubationstarttime = np.full((replicates, hostsize), 0)
+
+        if isinstance(hostinfected, str) and hostinfected == 'random':
+            self.hostinfected = np.full((replicates, hostsize), False)
+        else:
+            self.hostinfected = np.broadcast_to(hostinfected, (replicates, hostsize)).copy()
+
+        # Running totals of infected midges and inoculated host in each replicate, kept up to date by move()
+        self.numinfected = np.count_nonzero(self.infected, axis=1)
+        self.numinoculated = np.count_nonzero(self.hostincubationstarttime, axis=1)
+
+    # Stop advancing the replicates where mask is True
+    def retire(self, mask):
+        self.active &= ~mask
+
+    # Advance every active replicate by one step (dt is given in seconds)
+    def move(self, dt=1):
+        rep = np.flatnonzero(self.active)
+
+        if rep.size == 0:
+            self.step += 1
+            return
+
+        # Gather the state of the active replicates
+        positions = self.positions[rep]
+        infected = self.infected[rep]
+        btvincubating = self.btvincubating[rep]
+        incubationstarttime = self.incubationstarttime[rep]
+        hostinfected = self.hostinfected[rep]
+        hostincubationstarttime = self.hostincubationstarttime[rep]
+
+        # Update the infected midges and host to be those that have completed their incubation
+        completedeip = (incubationstarttime != 0) & (np.abs(incubationstarttime - self.step) >=
+                                                    self.daylength * self.eip[rep, None])
+        self.numinfected[rep] += np.count_nonzero(completedeip & ~infected, axis=1)
+        infected |= completedeip
+        hostinfected |= (hostincubationstarttime != 0) & (np.abs(hostincubationstarttime - self.step) >=
+                                                         self.daylength * self.incubationtime)
+
+        # Move the host and replace some midges once per day
+        if self.step % self.daylength == 0:
+            self.hostpositions[rep] = self.rng.uniform(low=0.0, high=self.envir.length,
+                                                       size=(rep.size, self.hostsize, 2))
+
+            if self.midgedeath:
+                # A midge dies if its uniform draw is above dps, only the dead midges draw a new position
+                r, i = np.nonzero(self.rng.random((rep.size, self.size)) >= self.dps[rep, None])
+
+                self.numinfected[rep] -= np.bincount(r[infected[r, i]], minlength=rep.size)
+                btvincubating[r, i] = False
+                infected[r, i] = False
+                incubationstarttime[r, i] = 0
+                positions[r, i] = self.rng.uniform(low=0.0, high=self.envir.length, size=(r.size, 2))
+
+        # A new random vector is generated every 30 minutes for the midges to travel in
+        if self.step % 30 == 0:
+            self.randomvector[rep] = self.generate_random_vectors(positions)
+
+        if self.movehosts:
+            hostpositions = self.hostpositions[rep]
+            hostpositions += self.generate_random_vectors(hostpositions) * self.hostwalkvelocity * dt
+            self.envir.confine(hostpositions, self.rng)
+            self.hostpositions[rep] = hostpositions
+
+        hostpositions = self.hostpositions[rep]
+        randomvector = self.randomvector[rep]
+
+        # Calculate which midges have fed lately by tracking when the last bloodmeal was
+        fed = (self.step - self.timeoffeeding[rep]) < self.biterate
+
+        # Vector and distance from each midge to its closest host in the same replicate
+        closesthost, midgedirections, hostdistances = batchnearesthost(positions, hostpositions, self.envir.period)
+
+        # Midges that detect a host and are hungry fly towards it, the others follow their random vector
+        detectinghost = (hostdistances < self.detectiondistance) & ~fed
+        np.divide(midgedirections, hostdistances[..., None], out=midgedirections, where=hostdistances[..., None] != 0)
+        positions = positions + self.activeflightvelocity * dt * np.where(detectinghost[..., None], midgedirections,
+                                                                           randomvector)
+        self.envir.confine(positions, self.rng)
+
+        # Feeding, hostdistances is indexed by host in the same way as MidgeSwarm.feed. Host without a midge of the same
+        # index are never within reach
+        lookupdistances = hostdistances
+        if self.hostsize > self.size:
+            lookupdistances = np.pad(hostdistances, ((0, 0), (0, self.hostsize - self.size)), constant_values=np.inf)
+        feedingmidges = (np.take_along_axis(lookupdistances, closesthost, axis=1) < self.bitethresholddistance * dt) & ~fed
+
+        # Only the midges that bite need random draws (host to vector and vector to host)
+        r, i = np.nonzero(feedingmidges)
+        h = closesthost[r, i]
+        draws = self.rng.random((2, r.size))
+
+        # Midges feeding on an infected host begin BTV incubation with probability pHtoV
+        exposed = (draws[0] < self.pHtoV) & hostinfected[r, h]
+        re, ie = r[exposed], i[exposed]
+        fresh = ~btvincubating[re, ie]
+        incubationstarttime[re[fresh], ie[fresh]] = self.step
+        btvincubating[re, ie] = True
+
+        # Host bitten by an infected midge are inoculated with probability pVtoH (if not already inoculated)
+        qualified = (draws[1] < self.pVtoH[rep[r]]) & infected[r, i]
+        r, h = r[qualified], h[qualified]
+        naive = hostincubationstarttime[r, h] == 0
+        hostincubationstarttime[r[naive], h[naive]] = self.step
+
+        # Count each newly inoculated host once (a start time of 0 means no incubation, as in MidgeSwarm.feed)
+        if self.step != 0:
+            newlyinoculated = np.unique(r[naive] * self.hostsize + h[naive]) // self.hostsize
+            self.numinoculated[rep] += np.bincount(newlyinoculated, minlength=rep.size)
+
+        # Scatter the state back to the active replicates
+        self.positions[rep] = positions
+        self.infected[rep] = infected
+        self.btvincubating[rep] = btvincubating
+        self.incubationstarttime[rep] = incubationstarttime
+        self.hostinfected[rep] = hostinfected
+        self.hostincubationstarttime[rep] = hostincubationstarttime
+        self.timeoffeeding[rep] = np.where(feedingmidges, self.step, self.timeoffeeding[rep])
+
+        # Increment the step counter
+        self.step += 1
+
+    # Move the active replicates until predicate(self) gives each of them an outcome other than -1, or until max_steps
+    # steps have been taken. Replicates are retired as soon as they reach an outcome. Returns the outcome of each
+    # replicate (-1 if undecided) and the step it was reached at
+    def run_until(self, predicate, max_steps, dt=1):
+        for i in range(max_steps + 1):
+            outcome = predicate(self)
+            finished = self.active & (outcome != -1)
+            self.outcome[finished] = outcome[finished]
+            self.finishstep[finished] = self.step
+            self.retire(finished)
+
+            if i == max_steps or not np.any(self.active):
+                break
+            self.move(dt)
+
+        return self.outcome, self.finishstep
+
+    # Returns unit vectors towards random points in the domain for an array of (..., 2) positions
+    def generate_random_vectors(self, positions):
+        flat = positions.reshape(-1, 2)
+        return generate_random_vector(self.envir.length, flat.shape[0], flat, self.rng).reshape(positions.shape)
+
+    # Returns the (replicates x size) array of infected midges
+    def get_infected(self):
+        return self.infected
 
 
 class HostSwarm:
 
-    def __init__(self, envir, size=50, positions='random', infected='random', steplength=1.0, incubationtime=2):
+    def __init__(self, envir, size=50, positions='random', infected='random', steplength=1.0, incubationtime=2, rng=None):
 
         # Define the population size of the swarm object
         self.size = size
@@ -283,55 +840,360 @@ class HostSwarm:
         # Define the average step length of a host per time step
         self.avgsteplength = steplength
 
-        # Keep track of the total number of infected host
-        self.totalinfectedhost = []
-
         # Attach the environment object to the swarm class
         self.envir = envir
 
         self.incubationtime = incubationtime
 
+        # Random number generator of the host (a Generator, a seed or None for fresh entropy)
+        self.rng = np.random.default_rng(rng)
+
         self.incubationstarttime = np.full(self.size,
                                            0)  # Create an array that tracks when midges begin incubation for BTV
 
-        self.pos_history = []
+        # Counts every change to the host positions so that spatial indexes know when to rebuild
+        self.version = 0
+        self.grid = None  # Uniform grid of the host positions, built by cellindex() and kept up to date by set_positions()
 
         # Create a random positions array for the host if desired, otherwise it is defined
-        if positions == 'random':
-            self.positions = np.random.uniform(low=0.0, high=envir.length, size=(self.size, 2))
+        if isinstance(positions, str) and positions == 'random':
+            self.positions = self.rng.uniform(low=0.0, high=envir.length, size=(self.size, 2))
         else:
             self.positions = positions
 
         # Create a random array of which host begin infected if desired, otherwise it is defined
-        if infected == 'random':
+        if isinstance(infected, str) and infected == 'random':
             self.infected = np.full(self.size, False)
-            # self.infected = np.random.choice([True, False], self.size, p=[0.2, 0.8])
+            # self.infected = self.rng.choice([True, False], self.size, p=[0.2, 0.8])
         else:
-            self.infected = infected
+            self.infected = np.array(infected, dtype=bool)
 
     # Move function that is called by the MidgeSwarm class, generates a new set of points for the host (random)
     def move(self):
-        self.positions = np.random.uniform(low=0.0, high=self.envir.length, size=(self.size, 2))
+        self.set_positions(self.rng.uniform(low=0.0, high=self.envir.length, size=(self.size, 2)))
+
+    # Replaces the host positions, always use this instead of assigning self.positions directly. Only the host that
+    # changed cell are moved in the grid
+    def set_positions(self, positions):
+        self.positions = positions
+        self.version += 1
+        if self.grid is not None:
+            self.grid.update(positions)
+            self.grid.version = self.version
+
+    # Returns the uniform grid of the host positions with cells of the given size (see HostGrid.py)
+    def cellindex(self, cellsize):
+        if self.grid is None or self.grid.searchradius != cellsize or self.grid.version != self.version:
+            self.grid = HostGrid(self.positions, cellsize, self.envir.length, self.envir.period)
+            self.grid.version = self.version
+        return self.grid
 
     # Returns the numpy array of positions
     def get_positions(self):
         return self.positions
 
 
-# Random movement function
-def generate_random_vector(length, size, positions):
-    # Creates a vector from the midge to a random position within the domain, then the midge will follow that vector
-    newvectors = np.random.uniform(low=0.0, high=length, size=(size, 2)) - positions
-    newvectors /= np.expand_dims(np.linalg.norm(newvectors, axis=1), axis=1)
-
-    return newvectors
-
-@jit
-def determineincubation(step, length, feedingmidges, infected, infectedprob, hostswarmincubationstarttime, closesthost):
-    qualified = feedingmidges & infected & infectedprob
-    for i in range(length):
-        if qualified[i] & (hostswarmincubationstarttime[closesthost[i]] == 0):
-            # The host can be infected with probability infectedprob from a single bite from an infected midge
-            hostswarmincubationstarttime[closesthost[i]] = step
-
-    return hostswarmincubationstarttime
+# Nearest host lookup backed by a KD-tree of the host positions. The tree is only rebuilt when the host positions have
+# changed (once per day, or every step if the hosts walk), which avoids building the (midges x 2 x host x 2) target matrix
+class NearestHostIndex:
+
+    def __init__(self, hostswarm):
+        self.hostswarm = hostswarm
+        self.tree = None
+        self.version = None  # The host position version the tree was built from
+
+    # Rebuild the tree if the host have moved since it was last built
+    def update(self):
+        if self.version != self.hostswarm.version:
+            # On a periodic domain the tree wraps around too, so it finds the closest periodic image of a host
+            period = self.hostswarm.envir.period
+            self.tree = cKDTree(self.hostswarm.get_positions(), boxsize=period if period > 0 else None)
+            self.version = self.hostswarm.version
+
+    # Returns the closest host to each position, the vector to that host and its distance
+    def query(self, positions):
+        self.update()
+
+        _, closesthost = self.tree.query(positions)
+
+        hostpositions = self.hostswarm.get_positions()
+        directions = hostpositions[closesthost] - positions
+        period = self.hostswarm.envir.period
+        if period > 0:
+            directions -= period * np.round(directions / period)
+        distances = np.linalg.norm(directions, axis=1)
+
+        return closesthost, directions, distances
+
+
+# Nearest host lookup limited to the host within radius, backed by the uniform grid of the host swarm. Positions with no
+# host within radius get host -1 and an infinite distance
+class HostGridIndex:
+
+    def __init__(self, hostswarm, radius):
+        self.hostswarm = hostswarm
+        self.radius = radius  # (m) Search radius, also the cell size of the grid
+
+    # Returns the closest host within radius of each position, the vector to that host and its distance
+    def query(self, positions):
+        grid = self.hostswarm.cellindex(self.radius)
+        return grid.query(positions, self.hostswarm.get_positions(), self.radius)
+
+
+# Outcome of an outbreak simulation for run_until: 1 once a host has been inoculated, 0 if BTV has died out without
+# inoculating a host and -1 while undecided. Works for both a MidgeSwarm and a MidgeEnsemble
+def outbreakoutcome(swarm):
+    return np.where(swarm.numinoculated != 0, 1, np.where(swarm.numinfected == 0, 0, -1))
+
+
+# Fused movement step for the numba engine, does the closest host search, position update and bite detection without
+# building any temporary arrays. Only the hungry midges search for a host (none if bitingday is False), the fed midges
+# follow their random vector. The biting midges and their host are written to biting and bitten, returns the number of
+# bites. Matches MidgeSwarm.movenumpy for the same random draws
+@njit(cache=True)
+def fusedstep(positions, randomvector, hostpositions, status, bitingday, detectiondistance, flightstep, bitereach, biting,
+              bitten, period):
+    # NOTE: bites are decided by the distance of the midge whose index is the closest host (see MidgeSwarm.movenumpy),
+    # so the distances of the first midges are needed before they move
+    lookupdistances = np.full(hostpositions.shape[0], np.inf)
+    for k in range(min(hostpositions.shape[0], positions.shape[0]) if bitingday else 0):
+        best = closesthostindex(positions[k, 0], positions[k, 1], hostpositions, period)
+        dx = hostpositions[best, 0] - positions[k, 0]
+        dy = hostpositions[best, 1] - positions[k, 1]
+        if period > 0:
+            dx -= period * np.round(dx / period)
+            dy -= period * np.round(dy / period)
+        lookupdistances[k] = np.sqrt(dx * dx + dy * dy)
+
+    bites = 0
+    for i in range(positions.shape[0]):
+        x = positions[i, 0]
+        y = positions[i, 1]
+
+        if status[i] & FED or not bitingday:
+            positions[i, 0] = x + flightstep * randomvector[i, 0]
+            positions[i, 1] = y + flightstep * randomvector[i, 1]
+            continue
+
+        best = closesthostindex(x, y, hostpositions, period)
+        dx = hostpositions[best, 0] - x
+        dy = hostpositions[best, 1] - y
+        if period > 0:
+            dx -= period * np.round(dx / period)
+            dy -= period * np.round(dy / period)
+        distance = np.sqrt(dx * dx + dy * dy)
+
+        # Fly towards the host if it is detected, otherwise follow the random vector
+        if distance < detectiondistance:
+            if distance != 0:
+                positions[i, 0] = x + flightstep * (dx / distance)
+                positions[i, 1] = y + flightstep * (dy / distance)
+        else:
+            positions[i, 0] = x + flightstep * randomvector[i, 0]
+            positions[i, 1] = y + flightstep * randomvector[i, 1]
+
+        if lookupdistances[best] < bitereach:
+            biting[bites] = i
+            bitten[bites] = best
+            bites += 1
+
+    return bites
+
+
+# Fused movement step for the numba engine on a host grid, like fusedstep but a hungry midge only searches the host
+# within detectiondistance in the neighbouring cells. A midge without a host in range follows its random vector and does
+# not bite. Only the midges in midges (sorted indices) are moved, the others are known to have no host in range (and
+# lookup distance infinity). Matches MidgeSwarm.movenumpy with hostindex='grid' for the same random draws. It is not
+# cached on disk: it inlines cellindex and gridnearest from HostGrid.py, and the numba cache only checks this file, so
+# a cached copy would silently keep an old version of them
+@njit
+def fusedgridstep(positions, randomvector, hostpositions, status, midges, bitingday, detectiondistance, flightstep,
+                  bitereach, biting, bitten, head, nxt, nearby, cellsize, cells, period):
+    lookupdistances = np.full(hostpositions.shape[0], np.inf)
+    for k in midges:
+        if k >= hostpositions.shape[0] or not bitingday:
+            break
+        cell = cellindex(positions[k, 0], positions[k, 1], cellsize, cells)
+        if nearby[cell] != 0:
+            best, distance = gridnearest(positions[k, 0], positions[k, 1], cell, hostpositions, head, nxt, cells,
+                                         detectiondistance, period)
+            lookupdistances[k] = np.sqrt(distance)
+
+    bites = 0
+    for i in midges:
+        x = positions[i, 0]
+        y = positions[i, 1]
+
+        best = -1
+        distance = np.inf
+        if bitingday and not status[i] & FED:
+            cell = cellindex(x, y, cellsize, cells)
+            if nearby[cell] != 0:
+                best, distance = gridnearest(x, y, cell, hostpositions, head, nxt, cells, detectiondistance, period)
+
+        if best < 0:
+            positions[i, 0] = x + flightstep * randomvector[i, 0]
+            positions[i, 1] = y + flightstep * randomvector[i, 1]
+            continue
+
+        # The host (or its closest periodic image) is within the detection distance, fly towards it
+        distance = np.sqrt(distance)
+        dx = hostpositions[best, 0] - x
+        dy = hostpositions[best, 1] - y
+        if period > 0:
+            dx -= period * np.round(dx / period)
+            dy -= period * np.round(dy / period)
+        if distance != 0:
+            positions[i, 0] = x + flightstep * (dx / distance)
+            positions[i, 1] = y + flightstep * (dy / distance)
+
+        if lookupdistances[best] < bitereach:
+            biting[bites] = i
+            bitten[bites] = best
+            bites += 1
+
+    return bites
+
+
+# Returns the first step in [lowerbound, window) at which every midge, flying flightstep along its random vector each
+# step, is strictly within radius of a host that stays in place, or window if there is none. The step is the first whole
+# number between the two roots of |position + t * flightstep * vector - host|^2 = radius^2. Only the host in the cells of
+# the host grid around the path of the midge are looked at, on a periodic domain (period > 0) the cells beyond an edge
+# are those across the seam with their host shifted by one period
+@njit(cache=True)
+def entrysteps(positions, randomvector, hostpositions, lowerbound, window, flightstep, radius, head, nxt, cellsize,
+               cells, period):
+    entry = np.full(positions.shape[0], window, dtype=np.int64)
+    radius2 = radius * radius
+
+    for i in range(positions.shape[0]):
+        if lowerbound[i] >= window:
+            continue
+        x = positions[i, 0]
+        y = positions[i, 1]
+        vx = flightstep * randomvector[i, 0]
+        vy = flightstep * randomvector[i, 1]
+        a = vx * vx + vy * vy
+
+        # Cells of the bounding box of the path, grown by the radius (points outside the domain are in the edge cells)
+        first = window
+        lowx, highx = min(x, x + window * vx) - radius, max(x, x + window * vx) + radius
+        lowy, highy = min(y, y + window * vy) - radius, max(y, y + window * vy) + radius
+        startx, endx = int(np.floor(lowx / cellsize)), int(np.floor(highx / cellsize))
+        starty, endy = int(np.floor(lowy / cellsize)), int(np.floor(highy / cellsize))
+        if period == 0:
+            startx, endx = min(max(startx, 0), cells - 1), min(max(endx, 0), cells - 1)
+            starty, endy = min(max(starty, 0), cells - 1), min(max(endy, 0), cells - 1)
+        for cx in range(startx, endx + 1):
+            for cy in range(starty, endy + 1):
+                # Cells beyond the edge of a periodic domain hold the host across the seam, shifted by one period
+                shiftx = period * (cx // cells)
+                shifty = period * (cy // cells)
+                j = head[(cx % cells) * cells + cy % cells]
+                while j >= 0:
+                    wx = x - (hostpositions[j, 0] + shiftx)
+                    wy = y - (hostpositions[j, 1] + shifty)
+                    c = wx * wx + wy * wy - radius2
+                    j = nxt[j]
+                    if a == 0:
+                        if c < 0:
+                            first = lowerbound[i]
+                        continue
+
+                    b = 2 * (vx * wx + vy * wy)
+                    discriminant = b * b - 4 * a * c
+                    if discriminant <= 0:
+                        continue
+                    root = np.sqrt(discriminant)
+                    t1 = (-b - root) / (2 * a)
+                    t2 = (-b + root) / (2 * a)
+                    if t2 <= lowerbound[i] or t1 >= first:
+                        continue
+
+                    t = lowerbound[i] if t1 < lowerbound[i] else int(np.floor(t1)) + 1
+                    if t < t2 and t < first:
+                        first = t
+
+        entry[i] = first
+
+    return entry
+
+
+# Returns the last step in [0, window) at which every midge, flying flightstep along its random vector each step, is
+# still inside [0, length] in both directions, or window if it never leaves the domain in the window
+@njit(cache=True)
+def exitsteps(positions, randomvector, window, flightstep, length):
+    exit = np.full(positions.shape[0], window, dtype=np.int64)
+
+    for i in range(positions.shape[0]):
+        last = float(window)
+        for k in range(2):
+            p = positions[i, k]
+            v = flightstep * randomvector[i, k]
+            if v > 0:
+                last = min(last, (length - p) / v)
+            elif v < 0:
+                last = min(last, -p / v)
+        if last < window:
+            exit[i] = max(int(np.floor(last)), 0)
+
+    return exit
+
+
+# Returns the index of the host closest to (x, y), the first host wins ties like np.argmin. With a period > 0 distances
+# are taken to the closest periodic image of every host
+@njit(cache=True)
+def closesthostindex(x, y, hostpositions, period):
+    best = 0
+    bestdistance = np.inf
+    for j in range(hostpositions.shape[0]):
+        dx = hostpositions[j, 0] - x
+        dy = hostpositions[j, 1] - y
+        if period > 0:
+            dx -= period * np.round(dx / period)
+            dy -= period * np.round(dy / period)
+        distance = dx * dx + dy * dy
+        if distance < bestdistance:
+            bestdistance = distance
+            best = j
+
+    return best
+
+
+# Closest host search for MidgeEnsemble, every midge is only compared with the host in its own replicate. With a period
+# > 0 distances are taken to the closest periodic image of every host
+@njit(cache=True)
+def batchnearesthost(positions, hostpositions, period):
+    replicates, size = positions.shape[0], positions.shape[1]
+    closesthost = np.empty((replicates, size), dtype=np.int64)
+    directions = np.empty((replicates, size, 2))
+    distances = np.empty((replicates, size))
+
+    for r in range(replicates):
+        for i in range(size):
+            x = positions[r, i, 0]
+            y = positions[r, i, 1]
+            best = 0
+            bestdistance = np.inf
+            for j in range(hostpositions.shape[1]):
+                dx = hostpositions[r, j, 0] - x
+                dy = hostpositions[r, j, 1] - y
+                if period > 0:
+                    dx -= period * np.round(dx / period)
+                    dy -= period * np.round(dy / period)
+                distance = dx * dx + dy * dy
+                if distance < bestdistance:
+                    bestdistance = distance
+                    best = j
+
+            dx = hostpositions[r, best, 0] - x
+            dy = hostpositions[r, best, 1] - y
+            if period > 0:
+                dx -= period * np.round(dx / period)
+                dy -= period * np.round(dy / period)
+            closesthost[r, i] = best
+            directions[r, i, 0] = dx
+            directions[r, i, 1] = dy
+            distances[r, i] = np.sqrt(dx * dx + dy * dy)
+
+    return closesthost, directions, distances
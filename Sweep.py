@@ -0,0 +1,159 @@
+import os
+import json
+import contextlib
+import multiprocessing
+import numpy as np
+import Profiler
+
+""" Parameter sweeps run every task of a parameter grid on a fixed size pool of worker processes instead of starting one
+process per task. The results are gathered in the parent process, which is the only process that writes them to disk.
+
+A sweep can be given a manifest, an append-only JSONL file with one line per finished (task, replicate). The line is
+flushed to disk as soon as the task returns, so when a sweep is restarted after a crash or a preemption every task that is
+already in the manifest is skipped and only the work that was still in flight is run again. Result files are written
+with atomicopen, which only moves a file into place once it is complete, so a partial file never appears.
+
+Given a SeedSequence, a sweep spawns one independent random stream per task and passes it to the task as a Generator,
+so the workers never share or reseed a global random state. Task i always gets child i of the sequence, which makes a
+sweep with a fixed seed reproducible no matter which worker runs a task or in which order the tasks finish.
+
+When profiling is switched on (MIDGEPY_PROFILE=1) every worker sends the profile of its tasks back with the result and
+the parent merges them, so a sweep gives a single report for all of its swarms.
+"""
+
+
+# Run func(*task) for every task on a pool of workers and return the results in the same order as tasks.
+# workers is the number of processes (None uses every CPU), chunksize is the number of tasks sent to a worker at a time
+# and order is an optional key function deciding which tasks are started first (for example the slowest ones).
+# If manifest is the name of a JSONL file, finished tasks are recorded in it and skipped when the sweep is run again.
+# If seedsequence is given every task is called as func(*task, rng=Generator) with its own stream spawned from it.
+# If report is a dict, it is filled with the merged profiler report of every task run by the workers
+def runsweep(func, tasks, workers=None, chunksize=1, order=None, manifest=None, seedsequence=None, report=None):
+    tasks = list(tasks)
+    keys = taskkeys(tasks)
+    seeds = seedsequence.spawn(len(tasks)) if seedsequence is not None else [None] * len(tasks)
+    finished = readmanifest(manifest) if manifest is not None else {}
+
+    results = [None] * len(tasks)
+    indices = []
+    for i, key in enumerate(keys):
+        if key in finished:
+            results[i] = finished[key]
+        else:
+            indices.append(i)
+
+    if order is not None:
+        indices.sort(key=lambda i: order(tasks[i]))
+
+    if len(indices) == 0:
+        return results
+
+    with contextlib.ExitStack() as stack:
+        log = None
+        if manifest is not None:
+            log = stack.enter_context(open(manifest, 'a'))
+            endline(manifest, log)
+        pool = stack.enter_context(multiprocessing.Pool(processes=workers))
+
+        jobs = [(func, i, tasks[i], seeds[i]) for i in indices]
+        reports = []
+        for index, result, profile in pool.imap_unordered(runtask, jobs, chunksize=chunksize):
+            results[index] = result
+            reports.append(profile)
+            if log is not None:
+                task, replicate = keys[index]
+                writeline(log, {'task': json.loads(task), 'replicate': replicate, 'result': result})
+
+    if report is not None:
+        report.update(Profiler.mergereports(reports))
+
+    return results
+
+
+# Runs a single task in a worker, returning its index so the parent can put the result back in place, and the profile of
+# the swarms the task created
+def runtask(args):
+    func, index, task, seed = args
+    with Profiler.collecting() as profilers:
+        if seed is None:
+            result = func(*task)
+        else:
+            result = func(*task, rng=np.random.default_rng(seed))
+    return index, result, Profiler.collect(profilers)
+
+
+# Returns the manifest key of every task, (task as JSON, replicate) where replicate counts earlier copies of the same task
+def taskkeys(tasks):
+    counts = {}
+    keys = []
+    for task in tasks:
+        task = json.dumps(tolist(task), default=tojson)
+        keys.append((task, counts.get(task, 0)))
+        counts[task] = counts.get(task, 0) + 1
+
+    return keys
+
+
+# Returns the results recorded in a manifest keyed like taskkeys, a line cut short by a crash is ignored
+def readmanifest(manifest):
+    finished = {}
+    if not os.path.exists(manifest):
+        return finished
+
+    with open(manifest) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            finished[(json.dumps(entry['task']), entry['replicate'])] = entry['result']
+
+    return finished
+
+
+# Append one entry to the manifest and make sure it reached the disk before the next task is recorded
+def writeline(f, entry):
+    f.write(json.dumps(entry, default=tojson) + '\n')
+    f.flush()
+    os.fsync(f.fileno())
+
+
+# Terminate a line cut short by a crash so the next entry starts on a line of its own
+def endline(manifest, f):
+    if f.tell() == 0:
+        return
+    with open(manifest, 'rb') as g:
+        g.seek(-1, os.SEEK_END)
+        if g.read(1) != b'\n':
+            f.write('\n')
+
+
+# Converts tuples (and NumPy arrays) to lists so a task has the same JSON form before and after a restart
+def tolist(value):
+    if isinstance(value, (tuple, list)):
+        return [tolist(v) for v in value]
+    return tojson(value) if isinstance(value, (np.generic, np.ndarray)) else value
+
+
+# JSON encoder for the NumPy values that appear in tasks and results
+def tojson(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Cannot write ' + type(value).__name__ + ' to a sweep manifest')
+
+
+# Open fname for writing through a temporary file that only replaces fname once the block finished without an error
+@contextlib.contextmanager
+def atomicopen(fname, mode='w', **kwargs):
+    tmpname = fname + '.tmp' + str(os.getpid())
+    try:
+        with open(tmpname, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpname, fname)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
@@ -0,0 +1,70 @@
+import os
+import hashlib
+import numpy as np
+
+""" Daily temperature schedules. The EIP, the survival and the biting of Culicoides all depend strongly on temperature,
+so instead of the constant eip, dps and biterate of MidgeSwarm a schedule gives their value for every day of a daily
+temperature series (in degrees Celsius, such as temperature.csv). All the per-day values are worked out once when the
+schedule is built, the swarm only indexes them at each day boundary:
+
+    EIP progression rate    0.018 (T - 13.4) per day, so the EIP ends after 1 / 0.018 degree-days above 13.4 C
+    Mortality rate          0.009 exp(0.16 T) per day, the daily probability of survival is exp(-mortality)
+    Biting rate             0.0002 T (T - 3.7) (41.9 - T)^(1 / 2.7) per day between 3.7 and 41.9 C (no biting outside
+                            that range), the bite interval is its inverse
+
+A run longer than the series starts the series over again.
+"""
+
+EIPTHRESHOLD = 13.4  # (C) Temperature below which the virus does not develop in the midge
+EIPSLOPE = 0.018  # (1/(C day)) Increase of the EIP progression rate per degree above EIPTHRESHOLD
+temperaturefile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'temperature.csv')
+
+
+class TemperatureSchedule:
+
+    def __init__(self, temperatures, startday=0):
+        self.temperatures = np.asarray(temperatures, dtype=float)  # (C) Temperature of every day of the series
+        if self.temperatures.ndim != 1 or self.temperatures.size == 0:
+            raise ValueError('A temperature schedule needs a non-empty series of daily temperatures')
+        self.days = self.temperatures.size  # Number of days in the series
+        self.startday = startday  # Day of the series the simulation starts on
+
+        temperatures = self.temperatures
+        # Degree-days above the EIP threshold gained by an incubating midge on every day (the EIP progression rate of the
+        # day is EIPSLOPE times this)
+        self.degreedays = np.maximum(temperatures - EIPTHRESHOLD, 0)
+        self.eipdegreedays = 1 / EIPSLOPE  # Degree-days an incubating midge needs to become infected
+
+        # Daily probability of survival
+        self.survival = np.exp(-0.009 * np.exp(0.16 * temperatures))
+
+        # Days on which the midges bite, outside of 3.7-41.9 C they neither seek nor bite a host
+        self.bitingdays = (temperatures > 3.7) & (temperatures < 41.9)
+
+        # (days) Time between two bloodmeals, at most one full series. A day without biting gets one full series too, it is
+        # never used as no midge feeds on it
+        bitingrate = 0.0002 * temperatures * (temperatures - 3.7) * np.maximum(41.9 - temperatures, 0) ** (1 / 2.7)
+        self.biteinterval = np.full(self.days, float(self.days))
+        np.divide(1, bitingrate, out=self.biteinterval, where=self.bitingdays)
+        np.minimum(self.biteinterval, self.days, out=self.biteinterval)
+
+    # Returns the index into the per-day arrays of a simulated day
+    def index(self, day):
+        return (self.startday + day) % self.days
+
+    # Returns a short hash of the series and start day, used to tell the result files of different schedules apart
+    def key(self):
+        return hashlib.sha256(self.temperatures.tobytes() + str(self.startday).encode()).hexdigest()[:8]
+
+    # Returns the schedule as run parameters for the result metadata (see Results.py)
+    def parameters(self):
+        return {'TEMP': self.temperatures.tolist(), 'TSTART': self.startday}
+
+    # Returns the bite interval of every day in steps of a simulated day of daylength steps
+    def biterates(self, daylength):
+        return np.maximum(np.ceil(daylength * self.biteinterval), 1).astype(np.int64)
+
+
+# Returns the schedule of a file of daily temperatures in degrees Celsius (one value per line)
+def loadschedule(fname=temperaturefile, startday=0):
+    return TemperatureSchedule(np.loadtxt(fname, ndmin=1), startday=startday)
@@ -1,6 +1,7 @@
 import numpy as np
 import Swarm
 import Environment
+from Recorder import Recorder
 
 midgehostratio = 100  # Midge/host ratio
 
@@ -13,7 +14,10 @@ hostinf = np.full(hostpop, False)  # Entire host population is naive to BTV
 
 envir = Environment.Envir(length=1000)
 host = Swarm.HostSwarm(envir=envir, size=hostpop, infected=hostinf)
-swrm = Swarm.MidgeSwarm(envir=envir, size=midgepop, hostswarm=host, infected=midges, dps=1.0, savepositions=True)
+# The position history of every midge is flushed to disk in chunks, so the memory use does not grow with the run length
+recorder = Recorder(path='Results/BiteRateAnalysis/AllInfectedRecording', stride=1)
+swrm = Swarm.MidgeSwarm(envir=envir, size=midgepop, hostswarm=host, infected=midges, dps=1.0, savepositions=True,
+                        recorder=recorder)
 swrm.pVtoH = 0  # Don't want to consider transmission to host
 swrm.eip = 100  # Again just to be sure
 dt = 60  # Step the simulation every 60 seconds (1 minute)
@@ -21,11 +25,13 @@ length = 2 * 300  # Total length in days of the simulation
 
 print("Moving swarm...")
 # RUN UNTIL ALL INFECTED MIDGES (FIRST GEN) HAVE DIED
-for i in range(length):
-    swrm.move(dt)
+# Closing the recorder at the end of the run (or when it is interrupted) writes the rows of the last partial chunk
+with recorder:
+    for i in range(length):
+        swrm.move(dt)
 
-    if i % 300 == 0:
-        print("Day", i // 300)
+        if i % 300 == 0:
+            print("Day", i // 300)
 
 print("Simulation finished")
 
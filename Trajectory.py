@@ -0,0 +1,76 @@
+import os
+import json
+import numpy as np
+
+""" Trajectories are stored as a (steps x agents x 2) float32 .npy array with a small .json sidecar that holds the step
+numbers and any other metadata of the run. The .npy file is written and read through a memmap, so a trajectory never has
+to fit in memory and a single agent or a time window can be read without loading the rest of the file.
+"""
+
+
+# Write a (steps x agents x 2) array of positions to fname (.npy), copying chunksteps steps at a time
+def savetrajectory(fname, positions, start=0, stride=1, chunksteps=100, **metadata):
+    steps = len(positions)
+    size = positions.shape[1] if steps else 0
+    out = np.lib.format.open_memmap(fname, mode='w+', dtype=np.float32, shape=(steps, size, 2))
+    for i in range(0, steps, chunksteps):
+        out[i:i + chunksteps] = positions[i:i + chunksteps]
+    out.flush()
+    del out
+
+    with open(sidecarname(fname), 'w') as f:
+        json.dump({'steps': steps, 'size': size, 'start': start, 'stride': stride, **metadata}, f)
+
+
+# Save positions with savetrajectory, a .csv fname writes the trajectory next to it (.npy) and converts it to CSV
+def exportpositions(fname, positions, label='Midge', **kwargs):
+    if fname.endswith('.csv'):
+        npyname = os.path.splitext(fname)[0] + '.npy'
+        savetrajectory(npyname, positions, **kwargs)
+        trajectorytocsv(npyname, fname, label=label)
+    else:
+        savetrajectory(fname, positions, **kwargs)
+
+
+# Returns the name of the metadata sidecar of a trajectory file
+def sidecarname(fname):
+    return os.path.splitext(fname)[0] + '.json'
+
+
+# Convert a trajectory file to a CSV file with one row per (step, agent), label is used for the column names
+def trajectorytocsv(fname, csvname, label='Midge', chunksteps=100):
+    trajectory = Trajectory(fname)
+
+    with open(csvname, 'w', newline='') as csvfile:
+        csvfile.write(','.join(['Step', label, label + ' X', label + ' Y']) + '\n')
+        ids = np.arange(trajectory.size)
+        for i in range(0, trajectory.steps, chunksteps):
+            chunk = trajectory.data[i:i + chunksteps]
+            rows = np.empty((chunk.shape[0], trajectory.size, 4))
+            rows[:, :, 0] = trajectory.stepnumbers[i:i + chunksteps, None]
+            rows[:, :, 1] = ids
+            rows[:, :, 2:] = chunk
+            np.savetxt(csvfile, rows.reshape(-1, 4), fmt=['%d', '%d', '%.9g', '%.9g'], delimiter=',')
+
+
+# Lazy reader for a trajectory file, nothing is read from disk until it is sliced
+class Trajectory:
+
+    def __init__(self, fname):
+        self.data = np.load(fname, mmap_mode='r')  # (steps x agents x 2) memmap of the positions
+
+        with open(sidecarname(fname)) as f:
+            self.metadata = json.load(f)
+
+        self.steps = self.data.shape[0]
+        self.size = self.data.shape[1]
+        self.stepnumbers = self.metadata['start'] + np.arange(self.steps) * self.metadata['stride']
+
+    # Returns the (steps x 2) path of a single agent
+    def midge(self, j):
+        return self.data[:, j, :]
+
+    # Returns the positions of every agent for the recorded steps in [start, stop)
+    def window(self, start, stop):
+        first, last = np.searchsorted(self.stepnumbers, [start, stop])
+        return self.data[first:last]
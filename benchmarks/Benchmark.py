@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import tracemalloc
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import Swarm
+import SwarmPreferentialMovement
+import Environment
+
+""" Benchmarks of the simulation step. Every case builds a swarm of a given size and times its move() method, the
+grid covers the scales the drivers run at: the number of midges, the number of host, host movement and midge death.
+Each case reports the steps per second and the peak memory (traced with tracemalloc in a separate run so the tracing
+does not slow down the timed steps).
+
+    python benchmarks/Benchmark.py                       Run every case and print the results
+    python benchmarks/Benchmark.py --save                Also store the results as the new baseline
+    python benchmarks/Benchmark.py --compare             Flag the cases that are slower or use more memory than the baseline
+    python benchmarks/Benchmark.py --midges 100 1000     Only run part of the grid
+    python benchmarks/Benchmark.py --hostindexes grid    Time the swarms with the grid host index instead of the KD-tree
+
+The timed window starts after a short warm-up (so the numba kernels are compiled) and covers one simulated day by
+default, which includes the daily host move and midge deaths.
+"""
+
+midgecounts = [100, 1000, 10000, 100000]  # Number of midges N
+hostcounts = [10, 100, 1000]  # Number of host M
+swarms = ['MidgeSwarm', 'MidgeSwarmPreferentialMovement']
+baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+mapimage = os.path.join(root, 'FarmMap.png')
+cachedir = os.path.join(root, '.midgepy_cache')
+dt = 60  # Step length in seconds, as used by the drivers
+
+
+# Returns the name of a case, used as its key in the baseline
+def casename(swarm, engine, hostindex, midges, hosts, movehosts, midgedeath):
+    options = [engine] if swarm == 'MidgeSwarm' else []
+    if hostindex != 'kdtree':
+        options.append(hostindex)
+    if options:
+        swarm += '[' + ','.join(options) + ']'
+    return '{}/N={}/M={}/movehosts={}/midgedeath={}'.format(swarm, midges, hosts, int(movehosts), int(midgedeath))
+
+
+# Returns a new swarm for a case, every case starts from the same seed
+def buildswarm(swarm, engine, hostindex, midges, hosts, movehosts, midgedeath, seed=0):
+    envir = Environment.Envir(length=1000)
+    if swarm == 'MidgeSwarm':
+        host = Swarm.HostSwarm(envir=envir, size=hosts, rng=seed)
+        return Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=midges, movehosts=movehosts, midgedeath=midgedeath,
+                                engine=engine, hostindex=hostindex)
+
+    host = SwarmPreferentialMovement.HostSwarm(envir=envir, size=hosts, rng=seed)
+    return SwarmPreferentialMovement.MidgeSwarmPreferentialMovement(envir=envir, hostswarm=host, mapimage=mapimage,
+                                                                    size=midges, movehosts=movehosts,
+                                                                    midgedeath=midgedeath, cachedir=cachedir,
+                                                                    hostindex=hostindex)
+
+
+# Returns the steps per second and the peak traced memory in bytes of a case. The steps are timed in runs of steps steps,
+# at least repeat runs and until mintime seconds were timed (so the small cases are not dominated by noise), and the
+# median run is kept so a single lucky or unlucky run does not move the result
+def runcase(swarm, engine, hostindex, midges, hosts, movehosts, midgedeath, steps, warmup, repeat, mintime,
+            memorysteps):
+    swrm = buildswarm(swarm, engine, hostindex, midges, hosts, movehosts, midgedeath)
+    for i in range(warmup):
+        swrm.move(dt)
+
+    rates = []
+    elapsed = 0.0
+    while len(rates) < repeat or elapsed < mintime:
+        start = time.perf_counter()
+        for i in range(steps):
+            swrm.move(dt)
+        rates.append(steps / (time.perf_counter() - start))
+        elapsed += steps / rates[-1]
+
+    # Peak memory of building the swarm and running it, traced on a fresh swarm
+    del swrm
+    tracemalloc.start()
+    try:
+        swrm = buildswarm(swarm, engine, hostindex, midges, hosts, movehosts, midgedeath)
+        for i in range(memorysteps):
+            swrm.move(dt)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return float(np.median(rates)), peak
+
+
+# Compare results with a baseline and return the names of the cases that regressed by more than tolerance
+def compare(results, reference, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in reference:
+            continue
+        old = reference[name]
+        slower = result['stepspersecond'] < old['stepspersecond'] * (1 - tolerance)
+        larger = result['peakbytes'] > old['peakbytes'] * (1 + tolerance)
+        if slower or larger:
+            regressions.append(name)
+            print('REGRESSION', name, '{:.1f} -> {:.1f} steps/s, {:.1f} -> {:.1f} MiB'.format(
+                old['stepspersecond'], result['stepspersecond'], old['peakbytes'] / 2**20, result['peakbytes'] / 2**20))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time MidgeSwarm.move and MidgeSwarmPreferentialMovement.move')
+    parser.add_argument('--midges', type=int, nargs='+', default=midgecounts, help='numbers of midges N')
+    parser.add_argument('--hosts', type=int, nargs='+', default=hostcounts, help='numbers of host M')
+    parser.add_argument('--swarms', nargs='+', default=swarms, choices=swarms, help='swarm classes to time')
+    parser.add_argument('--engines', nargs='+', default=['numpy'], choices=['numpy', 'numba'],
+                        help='engines of MidgeSwarm to time')
+    parser.add_argument('--hostindexes', nargs='+', default=['kdtree'], choices=['kdtree', 'grid'],
+                        help='closest host searches to time')
+    parser.add_argument('--steps', type=int, default=300, help='timed steps per run (300 is one simulated day)')
+    parser.add_argument('--warmup', type=int, default=30, help='untimed steps before the timed runs')
+    parser.add_argument('--repeat', type=int, default=3, help='minimum timed runs per case, the median is kept')
+    parser.add_argument('--mintime', type=float, default=2.0, help='minimum timed seconds per case')
+    parser.add_argument('--memorysteps', type=int, default=30, help='steps run while tracing the memory')
+    parser.add_argument('--baseline', default=baseline, help='baseline JSON file')
+    parser.add_argument('--save', action='store_true', help='store the results in the baseline file')
+    parser.add_argument('--compare', action='store_true', help='compare the results with the baseline file')
+    # Timings of the same tree vary by about 20% between runs on a shared machine, a smaller tolerance flags noise
+    parser.add_argument('--tolerance', type=float, default=0.35, help='relative slowdown or growth flagged by --compare')
+    args = parser.parse_args()
+
+    cases = []
+    for swarm in args.swarms:
+        engines = args.engines if swarm == 'MidgeSwarm' else [None]
+        cases += itertools.product([swarm], engines, args.hostindexes, args.midges, args.hosts, [False, True],
+                                   [False, True])
+
+    results = {}
+    print('{:<72}{:>12}{:>12}'.format('Case', 'Steps/s', 'Peak MiB'))
+    for case in cases:
+        stepspersecond, peak = runcase(*case, steps=args.steps, warmup=args.warmup, repeat=args.repeat,
+                                       mintime=args.mintime, memorysteps=args.memorysteps)
+        name = casename(*case)
+        results[name] = {'stepspersecond': stepspersecond, 'peakbytes': peak}
+        print('{:<72}{:>12.1f}{:>12.1f}'.format(name, stepspersecond, peak / 2**20), flush=True)
+
+    regressions = []
+    if args.compare:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+
+    if args.save:
+        # Cases that were not run this time keep their baseline entry
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)['results']
+        stored.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'numpy': np.__version__, 'steps': args.steps,
+                       'results': stored}, f, indent=1, sort_keys=True)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+import Swarm
+import Environment
+
+
+def build(adaptive, boundary=None):
+    envir = Environment.Envir(length=2000, boundary=boundary)
+    host = Swarm.HostSwarm(envir=envir, size=30, infected=np.r_[np.ones(5, bool), np.zeros(25, bool)], rng=1)
+    return Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=5000, rng=2, engine='numba', hostindex='grid',
+                            adaptive=adaptive)
+
+
+# With static host, coasting the idle midges gives the same run as stepping every midge every minute
+@pytest.mark.parametrize('boundary', [None, 'reflect', 'periodic'])
+def test_advance_matches_move(boundary):
+    stepped = build(False, boundary)
+    for i in range(900):
+        stepped.move(60)
+    coasted = build(True, boundary)
+    coasted.advance(900, 60)
+
+    assert coasted.step == stepped.step
+    assert np.array_equal(coasted.status, stepped.status)
+    assert coasted.numinfected == stepped.numinfected
+    assert coasted.numinoculated == stepped.numinoculated
+    assert np.array_equal(coasted.recorder.get('midgebitesperstep'), stepped.recorder.get('midgebitesperstep'))
+    assert np.allclose(coasted.positions, stepped.positions, rtol=0, atol=1e-6)
+
+
+# Coasting cannot follow move() with walking host or float32 positions
+@pytest.mark.parametrize('options', [{'movehosts': True}, {'precision': 'float32'}])
+def test_adaptive_rejects_unsupported_options(options):
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=10, rng=0)
+    with pytest.raises(ValueError):
+        Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=100, hostindex='grid', adaptive=True, **options)
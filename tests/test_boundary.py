@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import Swarm
+import Environment
+
+
+@pytest.mark.parametrize('boundary, expected', [
+    ('reflect', [[1.0, 5.0], [9.0, 5.0], [3.0, 4.0]]),
+    ('periodic', [[9.0, 5.0], [1.0, 5.0], [3.0, 4.0]]),
+    ('clamp', [[0.0, 5.0], [10.0, 10.0], [3.0, 4.0]]),
+])
+def test_confine(boundary, expected):
+    positions = np.array([[-1.0, 5.0], [11.0, 25.0], [3.0, 4.0]])
+    Environment.Envir(length=10, boundary=boundary).confine(positions)
+    assert np.allclose(positions, expected)
+
+
+def test_respawn_only_moves_positions_outside():
+    positions = np.array([[-1.0, 5.0], [3.0, 4.0], [5.0, 10.5]])
+    Environment.Envir(length=10, boundary='respawn').confine(positions, np.random.default_rng(0))
+    assert np.all((positions >= 0) & (positions <= 10))
+    assert np.array_equal(positions[1], [3.0, 4.0])
+
+
+# Closest periodic image of every host, by brute force
+def minimumimage(positions, hostpositions, length):
+    differences = hostpositions[None] - positions[:, None]
+    differences -= length * np.round(differences / length)
+    distances = np.linalg.norm(differences, axis=2)
+    return distances.argmin(axis=1), distances.min(axis=1)
+
+
+# Every host search measures distances across the seam of a periodic domain
+def test_periodic_host_searches():
+    length = 1000.0
+    envir = Environment.Envir(length=length, boundary='periodic')
+    rng = np.random.default_rng(0)
+    host = Swarm.HostSwarm(envir=envir, size=40, rng=1)
+    positions = rng.random((2000, 2)) * length
+    closest, distances = minimumimage(positions, host.positions, length)
+
+    index, directions, found = Swarm.NearestHostIndex(host).query(positions)
+    assert np.array_equal(index, closest)
+    assert np.allclose(found, distances)
+    assert np.allclose(np.linalg.norm(directions, axis=1), distances)
+
+    assert all(Swarm.closesthostindex(x, y, host.positions, envir.period) == c for (x, y), c in zip(positions, closest))
+
+    index, directions, found = Swarm.HostGridIndex(host, 300).query(positions)
+    inrange = distances < 300
+    assert np.array_equal(index[inrange], closest[inrange])
+    assert np.all(index[~inrange] == -1)
+    assert np.allclose(found[inrange], distances[inrange])
+
+
+# A midge just across the seam detects a host a few metres away and flies to it across the edge
+@pytest.mark.parametrize('engine, hostindex', [('numpy', 'kdtree'), ('numba', 'kdtree'), ('numba', 'grid')])
+def test_periodic_seam(engine, hostindex):
+    envir = Environment.Envir(length=1000, boundary='periodic')
+    host = Swarm.HostSwarm(envir=envir, size=1, positions=np.array([[2.0, 500.0]]), rng=0)
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=2, infected=np.zeros(2, dtype=bool), engine=engine,
+                             hostindex=hostindex, rng=1, midgedeath=False)
+    swarm.positions[:] = [[995.0, 500.0], [600.0, 100.0]]
+    swarm.status[:] = 0
+    swarm.step = 1
+    swarm.move(1)
+
+    assert np.allclose(swarm.positions[0], [995.5, 500.0])
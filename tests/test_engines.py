@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+import Swarm
+import Environment
+
+
+def run(engine, movehosts, midgedeath):
+    envir = Environment.Envir(length=500)
+    host = Swarm.HostSwarm(envir=envir, size=20, infected=np.r_[np.ones(5, bool), np.zeros(15, bool)], rng=0)
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=1000, rng=1, engine=engine, movehosts=movehosts,
+                             midgedeath=midgedeath, savepositions=True)
+    for i in range(700):
+        swarm.move(60)
+    return swarm
+
+
+# The numba engine gives the same run as the numpy engine from the same seed, bit for bit
+@pytest.mark.parametrize('movehosts', [False, True])
+@pytest.mark.parametrize('midgedeath', [False, True])
+def test_numba_matches_numpy(movehosts, midgedeath):
+    numpy = run('numpy', movehosts, midgedeath)
+    numba = run('numba', movehosts, midgedeath)
+
+    assert np.array_equal(numba.positions, numpy.positions)
+    assert np.array_equal(numba.hostswarm.positions, numpy.hostswarm.positions)
+    assert np.array_equal(numba.status, numpy.status)
+    assert sum(numpy.recorder.get('midgebitesperstep')) > 0
+    for name in numpy.recorder.channels:
+        assert np.array_equal(numba.recorder.get(name), numpy.recorder.get(name))
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import Swarm
+import Environment
+
+
+# More host than midges per replicate, every host index must be a valid lookup of the bite check
+def test_more_hosts_than_midges():
+    envir = Environment.Envir(length=200)
+    ensemble = Swarm.MidgeEnsemble(envir=envir, replicates=4, size=50, hostsize=100, movehosts=True, rng=0)
+    for i in range(600):
+        ensemble.move(60)
+
+    assert ensemble.step == 600
+    assert ensemble.positions.shape == (4, 50, 2)
+    assert np.all(ensemble.numinfected == np.count_nonzero(ensemble.infected, axis=1))
+
+
+# Replicates run until each of them has an outcome or the step cap
+def test_run_until_more_hosts_than_midges():
+    envir = Environment.Envir(length=200)
+    infected = np.zeros(20, dtype=bool)
+    infected[:5] = True
+    ensemble = Swarm.MidgeEnsemble(envir=envir, replicates=3, size=20, hostsize=60, infected=infected, rng=1)
+    outcome, finishstep = ensemble.run_until(Swarm.outbreakoutcome, 3000, 60)
+
+    assert outcome.shape == (3,)
+    assert np.all(np.isin(outcome, [-1, 0, 1]))
+    assert np.all((outcome == -1) | (finishstep >= 0))
+
+
+# Counts of infected midges, inoculated host, incubating midges and infected host of replicates runs of 900 steps
+def counts(ensemble, movehosts, replicates=40, size=200, hostsize=20):
+    envir = Environment.Envir(length=300)
+    infected = np.zeros(size, dtype=bool)
+    infected[:5] = True
+    hostinfected = np.zeros(hostsize, dtype=bool)
+    hostinfected[:4] = True
+
+    if ensemble:
+        swarm = Swarm.MidgeEnsemble(envir=envir, replicates=replicates, size=size, hostsize=hostsize, infected=infected,
+                                    hostinfected=hostinfected, eip=1, incubationtime=1, movehosts=movehosts, rng=0)
+        for i in range(900):
+            swarm.move(60)
+        return np.c_[swarm.numinfected, swarm.numinoculated, swarm.btvincubating.sum(axis=1),
+                     swarm.hostinfected.sum(axis=1)]
+
+    rows = []
+    for seed in range(replicates):
+        host = Swarm.HostSwarm(envir=envir, size=hostsize, infected=hostinfected, incubationtime=1, rng=seed)
+        swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=size, infected=infected, eip=1, rng=1000 + seed,
+                                 movehosts=movehosts, engine='numba')
+        for i in range(900):
+            swarm.move(60)
+        rows.append([swarm.numinfected, swarm.numinoculated, np.count_nonzero(swarm.btvincubating),
+                     np.count_nonzero(host.infected)])
+    return np.array(rows)
+
+
+# The ensemble applies the bite, transmission, death and incubation rules of MidgeSwarm, so its replicates have the same
+# statistics as serial swarms. The seeds are fixed, a rule that differs (such as half the pHtoV) moves a mean by more
+# than 6 standard errors
+@pytest.mark.parametrize('movehosts', [False, True])
+def test_ensemble_matches_serial_swarms(movehosts):
+    ensemble = counts(True, movehosts)
+    serial = counts(False, movehosts)
+
+    standarderror = np.sqrt(ensemble.var(axis=0, ddof=1) / len(ensemble) + serial.var(axis=0, ddof=1) / len(serial))
+    assert np.all(np.abs(ensemble.mean(axis=0) - serial.mean(axis=0)) < 3 * standarderror)
+    assert np.all(serial.mean(axis=0) > 0)
@@ -0,0 +1,49 @@
+import os
+import numpy as np
+import Swarm
+import Environment
+import SwarmPreferentialMovement
+from Recorder import Recorder
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# A fork given the random streams of its parent continues exactly as the parent does
+def test_fork_continues_like_parent():
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=20, rng=0)
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=500, rng=1, profile=True)
+    for i in range(400):
+        swarm.move(60)
+
+    fork = swarm.fork(1)[0]
+    fork.rng.bit_generator.state = swarm.rng.bit_generator.state
+    fork.hostswarm.rng.bit_generator.state = swarm.hostswarm.rng.bit_generator.state
+    assert fork.profiler.enabled and fork.profiler is not swarm.profiler
+    for i in range(400):
+        swarm.move(60)
+        fork.move(60)
+
+    assert np.array_equal(fork.positions, swarm.positions)
+    assert np.array_equal(fork.status, swarm.status)
+    assert np.array_equal(fork.recorder.get('totalinfectedmidges'), swarm.recorder.get('totalinfectedmidges'))
+
+
+# Forks keep the class, the shared map and the recorder settings of their parent
+def test_fork_keeps_subclass_and_recorder(tmp_path):
+    envir = Environment.Envir(length=1000)
+    host = SwarmPreferentialMovement.HostSwarm(envir=envir, size=10, rng=0)
+    swarm = SwarmPreferentialMovement.MidgeSwarmPreferentialMovement(
+        envir=envir, hostswarm=host, mapimage=os.path.join(root, 'FarmMap.png'), size=200, cachedir=None,
+        recorder=Recorder(path=str(tmp_path), stride=5))
+    for i in range(50):
+        swarm.move(60)
+
+    forks = swarm.fork(2)
+    for i, fork in enumerate(forks):
+        assert type(fork) is SwarmPreferentialMovement.MidgeSwarmPreferentialMovement
+        assert fork.map is swarm.map and fork.hostswarm is not swarm.hostswarm
+        assert fork.recorder.stride == 5
+        assert fork.recorder.path == os.path.join(str(tmp_path), 'fork' + str(i))
+        assert len(fork.recorder.get('totalinfectedmidges')) == 10
+        fork.move(60)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import Swarm
+import Environment
+
+
+# Closest host of every position and its distance, from the dense (midges x host) distance matrix
+def bruteforce(positions, hostpositions):
+    distances = np.linalg.norm(hostpositions[None] - positions[:, None], axis=2)
+    return distances.argmin(axis=1), distances.min(axis=1)
+
+
+def test_kdtree_matches_dense_search():
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=40, rng=0)
+    positions = np.random.default_rng(1).random((3000, 2)) * 1000
+    closest, distances = bruteforce(positions, host.positions)
+
+    index, directions, found = Swarm.NearestHostIndex(host).query(positions)
+    assert np.array_equal(index, closest)
+    assert np.allclose(found, distances)
+    assert np.allclose(directions, host.positions[closest] - positions)
+
+
+# One step of a swarm moves and feeds the midges as the dense search did, including the bite lookup by host index: a
+# hungry midge bites if the midge whose index is its closest host is within reach of its own closest host
+@pytest.mark.parametrize('engine', ['numpy', 'numba'])
+def test_step_matches_dense_search(engine):
+    envir = Environment.Envir(length=150)
+    host = Swarm.HostSwarm(envir=envir, size=15, rng=0)
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=300, rng=1, engine=engine, midgedeath=False)
+    swarm.status[:] = np.where(swarm.rng.random(swarm.size) < 0.3, Swarm.FED, 0)
+    swarm.step = 1
+
+    positions = swarm.positions.copy()
+    hungry = swarm.status & Swarm.FED == 0
+    closest, distances = bruteforce(positions, host.positions)
+    flightstep = swarm.activeflightvelocity * 60
+
+    seeking = hungry & (distances < swarm.detectiondistance)
+    expected = positions + flightstep * swarm.randomvector
+    expected[seeking] = positions[seeking] + flightstep * ((host.positions[closest] - positions) /
+                                                           distances[:, None])[seeking]
+    biting = np.flatnonzero(hungry & (distances[closest] < swarm.bitethresholddistance * 60))
+    assert biting.size > 0
+
+    swarm.move(60)
+
+    assert np.allclose(swarm.positions, expected)
+    assert np.array_equal(np.flatnonzero(swarm.timeoffeeding == 1), biting)
+    assert swarm.recorder.get('midgebitesperstep')[-1] == biting.size
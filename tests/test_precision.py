@@ -0,0 +1,81 @@
+import numpy as np
+import Swarm
+import Environment
+
+seeds = range(12)
+
+
+# Number of inoculated host after a short outbreak run from a given seed
+def inoculated(seed, precision):
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=50, rng=seed)
+    infected = np.zeros(2000, dtype=bool)
+    infected[:20] = True
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=2000, infected=infected, rng=seed + 1000,
+                             precision=precision, engine='numba')
+    for i in range(900):
+        swarm.move(60)
+    return swarm.numinoculated
+
+
+# float32 positions change single trajectories but not the outbreak statistics
+def test_float32_matches_float64_statistics():
+    single = np.array([inoculated(seed, 'float32') for seed in seeds])
+    double = np.array([inoculated(seed, 'float64') for seed in seeds])
+
+    standarderror = np.sqrt(single.var(ddof=1) / single.size + double.var(ddof=1) / double.size)
+    assert standarderror > 0 and single.mean() > 0
+    assert abs(single.mean() - double.mean()) < 3 * standarderror
+
+
+# Started from the same state, a float32 swarm follows the float64 swarm up to float32 rounding until the next vector
+# refresh (which draws float32 numbers). A midge that only follows its random vector has its position rounded to within
+# eps times its distance from the origin and its step to within eps times the flight step every step. A midge seeking a
+# host can turn the rounding into more (the direction to a host close by changes quickly), only its bites are compared
+def test_float32_positions_within_rounding():
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=50, infected=np.r_[np.ones(10, bool), np.zeros(40, bool)], rng=0)
+    double = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=5000, rng=1)
+    double.move(60)
+    single = Swarm.MidgeSwarm(envir=envir, hostswarm=Swarm.HostSwarm(envir=envir, size=50, rng=2), size=5000, rng=3,
+                              precision='float32')
+    single.restore(double.snapshot())
+
+    steps = 28
+    seeking = np.zeros(double.size, dtype=bool)
+    for i in range(steps):
+        distances = double.nearesthost.query(double.positions)[2]
+        seeking |= (double.status & Swarm.FED == 0) & (distances < double.detectiondistance)
+        double.move(60)
+        single.move(60)
+
+    assert np.array_equal(single.status, double.status)
+    assert np.array_equal(single.recorder.get('midgebitesperstep'), double.recorder.get('midgebitesperstep'))
+
+    # Without a boundary the midges stay within reach of the origin
+    flightstep = double.activeflightvelocity * 60
+    reach = envir.length + steps * flightstep
+    bound = (steps + 1) * np.finfo(np.float32).eps * (reach + flightstep)
+    assert np.count_nonzero(~seeking) > double.size // 2
+    assert np.abs(single.positions - double.positions)[~seeking].max() < bound
+
+
+# The INFECTED, INCUBATING and FED flags of every midge survive a snapshot and restore
+def test_status_roundtrip():
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=20, infected=np.r_[np.ones(5, bool), np.zeros(15, bool)], rng=0)
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=1000, rng=1, precision='float32')
+    for i in range(600):
+        swarm.move(60)
+    status = swarm.status.copy()
+    for flag in (Swarm.INFECTED, Swarm.INCUBATING, Swarm.FED):
+        assert np.any(status & flag)
+
+    copyhost = Swarm.HostSwarm(envir=envir, size=20, rng=2)
+    restored = Swarm.MidgeSwarm(envir=envir, hostswarm=copyhost, size=1000, rng=3, precision='float32')
+    restored.restore(swarm.snapshot())
+
+    assert restored.status.dtype == np.uint8
+    assert np.array_equal(restored.status, status)
+    assert np.array_equal(restored.get_infected(), swarm.get_infected())
+    assert np.array_equal(restored.positions, swarm.positions)
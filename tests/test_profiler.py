@@ -0,0 +1,35 @@
+import gc
+import weakref
+import numpy as np
+import Swarm
+import Profiler
+import Environment
+
+
+def build():
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=10, rng=0)
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=100, rng=1, profile=True)
+    for i in range(10):
+        swarm.move(60)
+    return swarm
+
+
+# A profiler created outside of a collecting block goes away with its swarm
+def test_profiler_freed_with_swarm():
+    profiler = weakref.ref(build().profiler)
+    gc.collect()
+    assert profiler() is None
+
+
+# The profilers created inside a collecting block are reported even after their swarms are gone
+def test_collecting_keeps_profilers():
+    with Profiler.collecting() as profilers:
+        build()
+        build()
+    report = Profiler.collect(profilers)
+
+    assert len(profilers) == 2
+    assert report['phases']['timers']['calls'] == 20
+    assert np.isclose(report['phases']['timers']['seconds'], sum(p.timings['timers'][1] for p in profilers))
+    assert Profiler.collectors == []
@@ -0,0 +1,47 @@
+import os
+import json
+import numpy as np
+import Swarm
+import Environment
+from Recorder import Recorder
+
+
+# Returns the rows of a channel recorded to disk, read back through its metadata sidecar
+def reopen(path, name):
+    with open(os.path.join(path, name + '.json')) as f:
+        metadata = json.load(f)
+    rows = np.fromfile(os.path.join(path, name + '.bin'), dtype=metadata['dtype'])
+    return metadata['count'], rows.reshape(-1, *metadata['shape'])
+
+
+# Closing a recorder writes the last chunk, which has not been filled
+def test_close_writes_partial_chunk(tmp_path):
+    with Recorder(path=str(tmp_path), chunksize=100) as recorder:
+        recorder.addchannel('count')
+        recorder.addchannel('positions', shape=(5, 2), dtype=np.float32)
+        for step in range(250):
+            recorder.record(step, 'count', step)
+            recorder.record(step, 'positions', np.full((5, 2), step))
+
+    count, rows = reopen(str(tmp_path), 'count')
+    assert count == 250 and np.array_equal(rows, np.arange(250))
+    count, rows = reopen(str(tmp_path), 'positions')
+    assert count == 250 and rows.shape == (250, 5, 2)
+    assert np.all(rows[-1] == 249)
+
+
+# Writing the results of a swarm closes its recorder, so the position history on disk is complete
+def test_writeresults_closes_recorder(tmp_path):
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=10, rng=0)
+    recorder = Recorder(path=str(tmp_path / 'recording'), stride=2, chunksize=50)
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=100, rng=1, savepositions=True, recorder=recorder)
+    for i in range(301):
+        swarm.move(60)
+    swarm.writetocsv(trial=0, fname=str(tmp_path / 'run'))
+
+    count, rows = reopen(str(tmp_path / 'recording'), 'positions')
+    assert count == 151 and rows.shape == (151, 100, 2)
+    assert np.array_equal(rows[-1], swarm.positions.astype(np.float32))
+    count, rows = reopen(str(tmp_path / 'recording'), 'hostpositions')
+    assert count == 151
@@ -0,0 +1,82 @@
+import os
+import json
+import numpy as np
+import pytest
+import Swarm
+import Environment
+import Temperature
+
+
+# Outside of 3.7-41.9 C nobody bites, the bite interval is then one full series
+def test_no_biting_outside_range():
+    temperatures = [-10, -5, 0, 2, 3.7, 20, 30, 41.9, 45]
+    schedule = Temperature.TemperatureSchedule(temperatures)
+    outside = np.array([True, True, True, True, True, False, False, True, True])
+
+    assert np.array_equal(schedule.bitingdays, ~outside)
+    assert np.all(schedule.biteinterval[outside] == len(temperatures))
+    assert np.all(schedule.biteinterval[~outside] < len(temperatures))
+    assert np.all(np.diff(schedule.survival) < 0)
+
+
+def test_schedule_of_temperature_file():
+    schedule = Temperature.loadschedule()
+    assert schedule.days == 64
+    assert np.all(schedule.degreedays > 0)
+    assert schedule.index(schedule.days + 3) == 3
+
+
+# The result files of a scheduled run record the temperature series instead of the constant parameters
+def test_results_record_schedule(tmp_path):
+    schedule = Temperature.TemperatureSchedule([20.0, 25.0, 30.0])
+    envir = Environment.Envir(length=1000)
+    host = Swarm.HostSwarm(envir=envir, size=10, rng=0)
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=200, rng=1, schedule=schedule)
+    for i in range(700):
+        swarm.move(60)
+    assert swarm.dps == schedule.survival[2]
+
+    swarm.writetocsv(trial=0, fname=str(tmp_path / 'run'))
+    fname = tmp_path / ('runSchedule' + schedule.key() + 'Trial0.json')
+    with open(fname) as f:
+        parameters = json.load(f)
+
+    assert parameters['TEMP'] == [20.0, 25.0, 30.0]
+    assert 'DPS' not in parameters and 'EIP' not in parameters and 'BR' not in parameters
+    assert os.path.exists(tmp_path / ('runSchedule' + schedule.key() + 'Trial0.csv'))
+
+
+engines = [{'engine': 'numpy'}, {'engine': 'numba'}, {'engine': 'numba', 'hostindex': 'grid'},
+           {'engine': 'numba', 'hostindex': 'grid', 'adaptive': True}]
+
+
+# Returns the bites of every step of a swarm of infected midges among infected host run for the days of the schedule
+def bites(temperatures, options):
+    schedule = Temperature.TemperatureSchedule(temperatures)
+    envir = Environment.Envir(length=300)
+    host = Swarm.HostSwarm(envir=envir, size=20, infected=np.r_[np.ones(10, bool), np.zeros(10, bool)], rng=0)
+    infected = np.zeros(2000, dtype=bool)
+    infected[:500] = True
+    swarm = Swarm.MidgeSwarm(envir=envir, hostswarm=host, size=2000, infected=infected, rng=1, schedule=schedule,
+                             **options)
+    swarm.advance(300 * len(temperatures), 60)
+    return np.asarray(swarm.recorder.get('midgebitesperstep')), swarm
+
+
+# Midges do not bite on a day outside of 3.7-41.9 C, hungry or not
+@pytest.mark.parametrize('options', engines)
+def test_cold_schedule_has_no_bites(options):
+    perstep, swarm = bites([0.0, -5.0, 2.0], options)
+    assert perstep.sum() == 0
+    assert swarm.numinoculated == 0
+    assert np.all(swarm.hostswarm.incubationstarttime[10:] == 0)
+    assert np.count_nonzero(swarm.btvincubating) == 0
+
+
+# Bites stop on the cold day and start again on the warm day after it
+@pytest.mark.parametrize('options', engines)
+def test_bites_only_on_warm_days(options):
+    perstep, swarm = bites([25.0, 0.0, 25.0], options)
+    assert perstep[:300].sum() > 0
+    assert perstep[300:600].sum() == 0
+    assert perstep[600:].sum() > 0